@@ -4,7 +4,7 @@ from types import TracebackType
 from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Type
 
 from melange.backends.sqs.sqs_backend_async import AsyncBaseSQSBackend
-from melange.models import Message, MessageDto, QueueWrapper
+from melange.models import Message, MessageDto, PublishResult, QueueWrapper
 from melange.serializers import JsonSerializer
 
 
@@ -39,6 +39,7 @@ class AIOSQSProducer:
         self.queue_attributes: Optional[Dict] = None
 
     async def start(self) -> None:
+        await self._backend.start()
         self.queue = await self._backend.get_queue(self.queue_name)
         self.queue_attributes = await self._backend.get_queue_attributes(self.queue)
 
@@ -63,7 +64,7 @@ class AIOSQSProducer:
             Message.create(content, None, 0), self.queue, **kwargs
         )
 
-    async def send_batch(self, entries: List[ValueContainer]) -> None:
+    async def send_batch(self, entries: List[ValueContainer]) -> List[PublishResult]:
         """
         Publishes data to a queue
 
@@ -71,6 +72,9 @@ class AIOSQSProducer:
             entries: The data to send to this queue. It will be serialized before sending to the
                 queue using the serializers.
             **kwargs: Any extra attributes. They will be passed to the backend upon publish.
+
+        Returns:
+            The outcome of publishing each of the entries, in the same order
         """
         if not self.queue:
             raise Exception(
@@ -101,7 +105,7 @@ class AIOSQSProducer:
                 )
             )
 
-        await self._backend.publish_to_queue_batch(message_dtos, self.queue)
+        return await self._backend.publish_to_queue_batch(message_dtos, self.queue)
 
     async def __aenter__(self) -> "AIOSQSProducer":
         await self.start()
@@ -115,6 +119,7 @@ class AIOSQSProducer:
     ) -> None:
         self.queue = None
         self.queue_attributes = None
+        await self._backend.close()
 
 
 class AIOSQSConsumer:
@@ -143,6 +148,7 @@ class AIOSQSConsumer:
         self.uncommitted_messages: List[Message] = []
 
     async def start(self) -> None:
+        await self._backend.start()
         self.queue = await self._backend.get_queue(self.queue_name)
 
     async def __aenter__(self) -> "AIOSQSConsumer":
@@ -156,6 +162,7 @@ class AIOSQSConsumer:
         exc_tb: Optional[TracebackType],
     ) -> None:
         self.queue = None
+        await self._backend.close()
 
     async def commit(self, message: Optional[Message] = None) -> None:
         if message:
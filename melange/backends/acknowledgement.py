@@ -0,0 +1,147 @@
+import logging
+import threading
+from types import TracebackType
+from typing import List, Optional, Type
+
+from anyio import CancelScope, Event, create_task_group, sleep
+from anyio.abc import TaskGroup
+
+from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
+from melange.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class AcknowledgementBuffer:
+    """
+    Buffers the acknowledgements of the messages and sends them through
+    `acknowledge_batch`, either when `max_size` messages are pending or when the
+    oldest pending message has been waiting for `linger` seconds.
+    """
+
+    def __init__(
+        self, backend: MessagingBackend, max_size: int = 10, linger: float = 0.2
+    ) -> None:
+        self._backend = backend
+        self.max_size = max_size
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._pending: List[Message] = []
+        self._timer: Optional[threading.Timer] = None
+
+    def add(self, message: Message) -> None:
+        """
+        Schedules the acknowledgement of a message
+        """
+        with self._lock:
+            self._pending.append(message)
+            if len(self._pending) < self.max_size:
+                if not self._timer:
+                    self._timer = threading.Timer(self.linger, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+            messages = self._take()
+
+        self._send(messages)
+
+    def flush(self) -> None:
+        """
+        Acknowledges all the pending messages right away
+        """
+        with self._lock:
+            messages = self._take()
+
+        self._send(messages)
+
+    def _take(self) -> List[Message]:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        messages, self._pending = self._pending, []
+        return messages
+
+    def _send(self, messages: List[Message]) -> None:
+        if not messages:
+            return
+
+        try:
+            self._backend.acknowledge_batch(messages)
+        except Exception as e:
+            logger.exception(e)
+
+
+class AsyncAcknowledgementBuffer:
+    """
+    Buffers the acknowledgements of the messages and sends them through
+    `acknowledge_batch`, either when `max_size` messages are pending or when the
+    oldest pending message has been waiting for `linger` seconds.
+
+    Use it as an async context manager: the pending acknowledgements are flushed
+    upon exiting the context.
+    """
+
+    def __init__(
+        self, backend: AsyncMessagingBackend, max_size: int = 10, linger: float = 0.2
+    ) -> None:
+        self._backend = backend
+        self.max_size = max_size
+        self.linger = linger
+        self._pending: List[Message] = []
+        self._has_pending = Event()
+        self._task_group: Optional[TaskGroup] = None
+
+    async def add(self, message: Message) -> None:
+        """
+        Schedules the acknowledgement of a message
+        """
+        self._pending.append(message)
+        if len(self._pending) >= self.max_size:
+            await self.flush()
+        elif len(self._pending) == 1:
+            self._has_pending.set()
+
+    async def flush(self) -> None:
+        """
+        Acknowledges all the pending messages right away
+        """
+        messages, self._pending = self._pending, []
+        if not messages:
+            return
+
+        try:
+            await self._backend.acknowledge_batch(messages)
+        except Exception as e:
+            logger.exception(e)
+
+    async def __aenter__(self) -> "AsyncAcknowledgementBuffer":
+        self._task_group = create_task_group()
+        await self._task_group.__aenter__()
+        self._task_group.start_soon(self._run)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        assert self._task_group
+        self._task_group.cancel_scope.cancel()
+        try:
+            return await self._task_group.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            with CancelScope(shield=True):
+                await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            await sleep(self.linger)
+            self._has_pending = Event()
+            # The flushed messages are no longer pending, so let them be sent even
+            # if the buffer exits in the meantime
+            with CancelScope(shield=True):
+                await self.flush()
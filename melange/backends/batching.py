@@ -0,0 +1,234 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from types import TracebackType
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type
+
+from anyio import CancelScope, Event, Lock, create_task_group, sleep
+from anyio.abc import TaskGroup
+
+from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
+from melange.models import MessageDto, PublishResult, QueueWrapper
+
+logger = logging.getLogger(__name__)
+
+PublishCallback = Callable[[PublishResult], Any]
+PendingMessages = List[Tuple[MessageDto, "Future[PublishResult]"]]
+PendingCallbacks = List[Tuple[MessageDto, Optional[PublishCallback]]]
+
+
+class BatchingPublisher:
+    """
+    Collects the messages published to each queue and sends them through
+    `publish_to_queue_batch`, either when `max_size` messages are pending for the
+    queue or when the oldest pending message has been waiting for `linger` seconds.
+
+    Every publish returns a future that resolves to the outcome of publishing the
+    message. Call `flush` before shutting down to send the pending messages.
+    Pending messages are grouped by queue object, so publish to a queue through
+    the same object every time (the queues of the backends are cached by name).
+    The batches of a queue are sent one at a time, in the order they were taken.
+    """
+
+    def __init__(
+        self, backend: MessagingBackend, max_size: int = 10, linger: float = 0.05
+    ) -> None:
+        self._backend = backend
+        self.max_size = max_size
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._pending: Dict[QueueWrapper, PendingMessages] = {}
+        self._ready: Dict[QueueWrapper, Deque[PendingMessages]] = {}
+        self._send_locks: Dict[QueueWrapper, threading.Lock] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def publish(
+        self, message_dto: MessageDto, queue: QueueWrapper
+    ) -> "Future[PublishResult]":
+        """
+        Schedules the publishing of a message to the queue
+        """
+        future: "Future[PublishResult]" = Future()
+        with self._lock:
+            pending = self._pending.setdefault(queue, [])
+            pending.append((message_dto, future))
+            if len(pending) < self.max_size:
+                if not self._timer:
+                    self._timer = threading.Timer(self.linger, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return future
+
+            del self._pending[queue]
+            self._take(queue, pending)
+
+        self._send_ready(queue)
+        return future
+
+    def flush(self) -> None:
+        """
+        Publishes all the pending messages right away
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            pending_by_queue, self._pending = self._pending, {}
+            for queue, pending in pending_by_queue.items():
+                self._take(queue, pending)
+            queues = list(self._ready)
+
+        for queue in queues:
+            self._send_ready(queue)
+
+    def _take(self, queue: QueueWrapper, pending: PendingMessages) -> None:
+        # Called with the lock held, so batches are ready in the order they are taken
+        self._ready.setdefault(queue, deque()).append(pending)
+        self._send_locks.setdefault(queue, threading.Lock())
+
+    def _send_ready(self, queue: QueueWrapper) -> None:
+        """
+        Sends the batches of the queue that are ready, one thread at a time, so
+        that they are never sent concurrently or out of order
+        """
+        with self._send_locks[queue]:
+            while True:
+                with self._lock:
+                    if not self._ready[queue]:
+                        return
+                    pending = self._ready[queue].popleft()
+
+                self._send(queue, pending)
+
+    def _send(self, queue: QueueWrapper, pending: PendingMessages) -> None:
+        try:
+            results = self._backend.publish_to_queue_batch(
+                [message_dto for message_dto, _ in pending], queue
+            )
+        except Exception as e:
+            logger.exception(e)
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+
+
+class AsyncBatchingPublisher:
+    """
+    Collects the messages published to each queue and sends them through
+    `publish_to_queue_batch`, either when `max_size` messages are pending for the
+    queue or when the oldest pending message has been waiting for `linger` seconds.
+
+    Every publish may supply a callback, which is called with the outcome of
+    publishing the message. Use it as an async context manager: the pending
+    messages are flushed upon exiting the context. Pending messages are grouped by
+    queue object, so publish to a queue through the same object every time. The
+    batches of a queue are sent one at a time, in the order they were taken.
+    """
+
+    def __init__(
+        self,
+        backend: AsyncMessagingBackend,
+        max_size: int = 10,
+        linger: float = 0.05,
+    ) -> None:
+        self._backend = backend
+        self.max_size = max_size
+        self.linger = linger
+        self._pending: Dict[QueueWrapper, PendingCallbacks] = {}
+        self._ready: Dict[QueueWrapper, Deque[PendingCallbacks]] = {}
+        self._send_locks: Dict[QueueWrapper, Lock] = {}
+        self._has_pending = Event()
+        self._task_group: Optional[TaskGroup] = None
+
+    async def publish(
+        self,
+        message_dto: MessageDto,
+        queue: QueueWrapper,
+        callback: Optional[PublishCallback] = None,
+    ) -> None:
+        """
+        Schedules the publishing of a message to the queue
+        """
+        pending = self._pending.setdefault(queue, [])
+        pending.append((message_dto, callback))
+        if len(pending) >= self.max_size:
+            del self._pending[queue]
+            self._take(queue, pending)
+            await self._send_ready(queue)
+        else:
+            self._has_pending.set()
+
+    async def flush(self) -> None:
+        """
+        Publishes all the pending messages right away
+        """
+        pending_by_queue, self._pending = self._pending, {}
+        for queue, pending in pending_by_queue.items():
+            self._take(queue, pending)
+
+        for queue in list(self._ready):
+            await self._send_ready(queue)
+
+    def _take(self, queue: QueueWrapper, pending: PendingCallbacks) -> None:
+        self._ready.setdefault(queue, deque()).append(pending)
+        self._send_locks.setdefault(queue, Lock())
+
+    async def _send_ready(self, queue: QueueWrapper) -> None:
+        """
+        Sends the batches of the queue that are ready, one task at a time, so
+        that they are never sent concurrently or out of order. The messages taken
+        are no longer pending, so they are sent even if the task is cancelled.
+        """
+        with CancelScope(shield=True):
+            async with self._send_locks[queue]:
+                while self._ready[queue]:
+                    await self._send(queue, self._ready[queue].popleft())
+
+    async def _send(self, queue: QueueWrapper, pending: PendingCallbacks) -> None:
+        message_dtos = [message_dto for message_dto, _ in pending]
+        try:
+            results = await self._backend.publish_to_queue_batch(message_dtos, queue)
+        except Exception as e:
+            logger.exception(e)
+            results = [
+                PublishResult(message_dto, error=str(e)) for message_dto in message_dtos
+            ]
+
+        for (_, callback), result in zip(pending, results):
+            if callback:
+                try:
+                    callback(result)
+                except Exception as e:
+                    logger.exception(e)
+
+    async def __aenter__(self) -> "AsyncBatchingPublisher":
+        self._task_group = create_task_group()
+        await self._task_group.__aenter__()
+        self._task_group.start_soon(self._run)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        assert self._task_group
+        self._task_group.cancel_scope.cancel()
+        try:
+            return await self._task_group.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            with CancelScope(shield=True):
+                await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            await sleep(self.linger)
+            self._has_pending = Event()
+            await self.flush()
@@ -0,0 +1,238 @@
+import logging
+import threading
+from contextlib import contextmanager
+from types import TracebackType
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from anyio import create_task_group, current_time, sleep
+from anyio.abc import TaskGroup
+
+from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
+from melange.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class VisibilityHeartbeat:
+    """
+    Keeps the messages being processed invisible to other consumers. Every `interval`
+    seconds it extends the visibility timeout of all the tracked messages
+    to `visibility_timeout` seconds from then, until they stop being tracked.
+    """
+
+    def __init__(
+        self,
+        backend: MessagingBackend,
+        visibility_timeout: int,
+        interval: Optional[float] = None,
+    ) -> None:
+        self._backend = backend
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval or visibility_timeout / 2
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, Message] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def track(self, messages: List[Message]) -> Iterator[None]:
+        """
+        Extends the visibility of the messages for as long as the context is active
+        """
+        with self._lock:
+            for message in messages:
+                self._in_flight[id(message)] = message
+        try:
+            yield
+        finally:
+            with self._lock:
+                for message in messages:
+                    self._in_flight.pop(id(message), None)
+
+    def beat(self) -> None:
+        with self._lock:
+            messages = list(self._in_flight.values())
+
+        if not messages:
+            return
+
+        try:
+            self._backend.change_visibility_batch(messages, self.visibility_timeout)
+        except Exception as e:
+            logger.exception(e)
+
+    def __enter__(self) -> "VisibilityHeartbeat":
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="melange-heartbeat", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.beat()
+
+
+class AsyncVisibilityHeartbeat:
+    """
+    Keeps the messages being processed invisible to other consumers. Every `interval`
+    seconds it extends the visibility timeout of all the tracked messages
+    to `visibility_timeout` seconds from then, until they stop being tracked.
+    """
+
+    def __init__(
+        self,
+        backend: AsyncMessagingBackend,
+        visibility_timeout: int,
+        interval: Optional[float] = None,
+    ) -> None:
+        self._backend = backend
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval or visibility_timeout / 2
+        self._in_flight: Dict[int, Message] = {}
+        self._task_group: Optional[TaskGroup] = None
+
+    @contextmanager
+    def track(self, messages: List[Message]) -> Iterator[None]:
+        """
+        Extends the visibility of the messages for as long as the context is active
+        """
+        for message in messages:
+            self._in_flight[id(message)] = message
+        try:
+            yield
+        finally:
+            for message in messages:
+                self._in_flight.pop(id(message), None)
+
+    async def beat(self) -> None:
+        messages = list(self._in_flight.values())
+        if not messages:
+            return
+
+        try:
+            await self._backend.change_visibility_batch(
+                messages, self.visibility_timeout
+            )
+        except Exception as e:
+            logger.exception(e)
+
+    async def __aenter__(self) -> "AsyncVisibilityHeartbeat":
+        self._task_group = create_task_group()
+        await self._task_group.__aenter__()
+        self._task_group.start_soon(self._run)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        assert self._task_group
+        self._task_group.cancel_scope.cancel()
+        return await self._task_group.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(self.interval)
+            await self.beat()
+
+
+class AsyncBufferWatchdog:
+    """
+    Watches the messages waiting in the buffer between the receivers and the workers,
+    recording when each of them was received. Every `interval` seconds, the messages
+    that have been waiting for half of their `visibility_timeout` are either extended
+    for another `visibility_timeout` seconds or, if `release` is set, released
+    (their visibility timeout set to 0) so that other consumers can process them
+    right away. Either way, the backend does not redeliver them while they are still
+    waiting locally.
+    """
+
+    def __init__(
+        self,
+        backend: AsyncMessagingBackend,
+        visibility_timeout: int,
+        release: bool = False,
+        interval: Optional[float] = None,
+    ) -> None:
+        self._backend = backend
+        self.visibility_timeout = visibility_timeout
+        self.release = release
+        self.interval = interval or visibility_timeout / 4
+        self._buffered: Dict[int, Tuple[float, List[Message]]] = {}
+        self._released: Set[int] = set()
+        self._task_group: Optional[TaskGroup] = None
+
+    def buffer(self, item: object, messages: List[Message]) -> None:
+        """
+        Starts watching the messages of an item that has just been received
+        """
+        self._buffered[id(item)] = (current_time(), messages)
+
+    def take(self, item: object) -> bool:
+        """
+        Stops watching the messages of an item that is about to be dispatched.
+        Returns False if they have been released and must not be dispatched
+        """
+        self._buffered.pop(id(item), None)
+        if id(item) in self._released:
+            self._released.discard(id(item))
+            return False
+        return True
+
+    async def check(self) -> None:
+        now = current_time()
+        expiring = [
+            (key, messages)
+            for key, (received_at, messages) in self._buffered.items()
+            if now - received_at >= self.visibility_timeout / 2
+        ]
+        if not expiring:
+            return
+
+        for key, messages in expiring:
+            if self.release:
+                del self._buffered[key]
+                self._released.add(key)
+            else:
+                self._buffered[key] = (now, messages)
+
+        try:
+            await self._backend.change_visibility_batch(
+                [message for _, messages in expiring for message in messages],
+                0 if self.release else self.visibility_timeout,
+            )
+        except Exception as e:
+            logger.exception(e)
+
+    async def __aenter__(self) -> "AsyncBufferWatchdog":
+        self._task_group = create_task_group()
+        await self._task_group.__aenter__()
+        self._task_group.start_soon(self._run)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        assert self._task_group
+        self._task_group.cancel_scope.cancel()
+        return await self._task_group.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(self.interval)
+            await self.check()
@@ -1,7 +1,13 @@
 import weakref
 from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple
 
-from melange.models import Message, MessageDto, QueueWrapper, TopicWrapper
+from melange.models import (
+    Message,
+    MessageDto,
+    PublishResult,
+    QueueWrapper,
+    TopicWrapper,
+)
 
 
 class MessagingBackend:
@@ -85,6 +91,22 @@ class MessagingBackend:
         """
         raise NotImplementedError
 
+    def yield_batches(
+        self, queue: QueueWrapper, **kwargs: Any
+    ) -> Iterable[List[Message]]:
+        """
+        Yields available messages from the queue, grouped in the batches
+        they were received in.
+
+        Args:
+            queue: the queue object
+            **kwargs: Other parameters/options required by the backend
+
+        Returns:
+            An iterable which will poll the queue upon requesting more batches
+        """
+        raise NotImplementedError
+
     def publish_to_topic(
         self,
         message: Message,
@@ -106,6 +128,21 @@ class MessagingBackend:
     ) -> None:
         raise NotImplementedError
 
+    def publish_to_queue_batch(
+        self, message_dtos: List[MessageDto], queue: QueueWrapper
+    ) -> List[PublishResult]:
+        """
+        Publishes a batch of messages to the queue
+
+        Args:
+            message_dtos: the messages to send
+            queue: the queue to send the message to
+
+        Returns:
+            The outcome of publishing each message, in the same order
+        """
+        raise NotImplementedError
+
     def acknowledge(self, message: Message) -> None:
         """
         Acknowledges a message so that it won't be redelivered by
@@ -113,6 +150,27 @@ class MessagingBackend:
         """
         raise NotImplementedError
 
+    def acknowledge_batch(self, messages: List[Message]) -> None:
+        """
+        Acknowledges a message so that it won't be redelivered by
+        the messaging infrastructure in the future (batch version)
+        """
+        raise NotImplementedError
+
+    def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        """
+        Changes the visibility timeout of messages already received, so that
+        they won't be delivered again until `visibility_timeout` seconds from now.
+        A timeout of 0 makes them available again right away.
+
+        Args:
+            messages: the messages to change
+            visibility_timeout: the new visibility timeout, in seconds
+        """
+        raise NotImplementedError
+
     def close_connection(self) -> None:
         """
         Override this function if you want to use some finalizer code
@@ -244,13 +302,16 @@ class AsyncMessagingBackend:
 
     async def publish_to_queue_batch(
         self, message_dtos: List[MessageDto], queue: QueueWrapper
-    ) -> None:
+    ) -> List[PublishResult]:
         """
         Publishes a batch of messages to the queue
 
         Args:
             message_dtos: the messages to send
             queue: the queue to send the message to
+
+        Returns:
+            The outcome of publishing each message, in the same order
         """
         raise NotImplementedError
 
@@ -273,6 +334,27 @@ class AsyncMessagingBackend:
         """
         raise NotImplementedError
 
+    async def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        """
+        Changes the visibility timeout of messages already received, so that
+        they won't be delivered again until `visibility_timeout` seconds from now.
+        A timeout of 0 makes them available again right away.
+
+        Args:
+            messages: the messages to change
+            visibility_timeout: the new visibility timeout, in seconds
+        """
+        raise NotImplementedError
+
+    def get_message_group(self, message: Message) -> Optional[str]:
+        """
+        Returns the group a received message belongs to, whose messages must be
+        processed in order (e.g. the `MessageGroupId` of a FIFO queue), if any
+        """
+        return None
+
     def close_connection(self) -> None:
         """
         Override this function if you want to use some finalizer code
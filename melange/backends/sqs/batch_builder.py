@@ -0,0 +1,106 @@
+from typing import Dict, List, Tuple
+
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+
+class BatchBuilder:
+    """
+    Packs the entries of a batch API call (SendMessageBatch for SQS, PublishBatch
+    for SNS) into the fewest batches that stay within both the limit of
+    `max_entries` entries and the limit of `max_bytes` bytes per call.
+
+    The size of an entry is what the services count towards the limit: the
+    encoded body (`body_key`) plus the name, type and value of every message
+    attribute. A single publish (SendMessage, Publish) has the same limit as a
+    whole batch, so an entry larger than `max_bytes` cannot be sent at all:
+    `reject_oversized` sets those entries apart, failed, without calling the API.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_BATCH_ENTRIES,
+        max_bytes: int = MAX_BATCH_BYTES,
+        body_key: str = "MessageBody",
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.body_key = body_key
+
+    def size(self, entry: Dict) -> int:
+        size = len(entry.get(self.body_key, "").encode())
+        for name, attribute in entry.get("MessageAttributes", {}).items():
+            size += len(name.encode()) + len(attribute["DataType"].encode())
+            if "StringValue" in attribute:
+                size += len(attribute["StringValue"].encode())
+            if "BinaryValue" in attribute:
+                size += len(attribute["BinaryValue"])
+        return size
+
+    def reject_oversized(self, entries: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Returns the entries that can be sent, and the failures of those that
+        cannot, as in the `Failed` list of a batch response
+        """
+        sendable, failed = [], []
+        for entry in entries:
+            size = self.size(entry)
+            if size <= self.max_bytes:
+                sendable.append(entry)
+                continue
+
+            failed.append(
+                {
+                    "Id": entry["Id"],
+                    "Code": "MessageTooLong",
+                    "Message": f"The message takes {size} bytes, "
+                    f"more than the {self.max_bytes} allowed",
+                    "SenderFault": True,
+                }
+            )
+
+        return sendable, failed
+
+    def build(self, entries: List[Dict], ordered: bool = False) -> List[List[Dict]]:
+        """
+        Packs the entries into batches. Unless the entries must keep their order
+        (`ordered`, as in FIFO queues), the largest ones are placed first, each in
+        the first batch with room for it, which leaves the least room unused.
+        """
+        sized = [(self.size(entry), entry) for entry in entries]
+        if ordered:
+            return self._build_in_order(sized)
+
+        batches: List[List[Dict]] = []
+        batch_sizes: List[int] = []
+        for size, entry in sorted(sized, key=lambda sized_entry: -sized_entry[0]):
+            for i, batch in enumerate(batches):
+                if self._fits(batch, batch_sizes[i], size):
+                    batch.append(entry)
+                    batch_sizes[i] += size
+                    break
+            else:
+                batches.append([entry])
+                batch_sizes.append(size)
+
+        return batches
+
+    def _build_in_order(self, sized: List[Tuple[int, Dict]]) -> List[List[Dict]]:
+        batches: List[List[Dict]] = []
+        batch: List[Dict] = []
+        batch_size = 0
+        for size, entry in sized:
+            if batch and not self._fits(batch, batch_size, size):
+                batches.append(batch)
+                batch, batch_size = [], 0
+
+            batch.append(entry)
+            batch_size += size
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _fits(self, batch: List[Dict], batch_size: int, size: int) -> bool:
+        return len(batch) < self.max_entries and batch_size + size <= self.max_bytes
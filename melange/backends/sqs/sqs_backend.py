@@ -1,20 +1,39 @@
 import json
 import logging
+import math
 import uuid
 from json import JSONDecodeError
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import boto3
+import funcy
 
 from melange.backends.interfaces import MessagingBackend
-from melange.models import Message, MessageDto, QueueWrapper, TopicWrapper
+from melange.backends.sqs.batch_builder import MAX_BATCH_BYTES, BatchBuilder
+from melange.infrastructure.cache import LocalCache
+from melange.models import (
+    Message,
+    MessageDto,
+    PublishResult,
+    QueueWrapper,
+    TopicWrapper,
+)
 
 logger = logging.getLogger(__name__)
 
 
 class BaseSQSBackend(MessagingBackend):
     """
-    Base class for SQS Backends
+    Base class for SQS Backends.
+
+    The queues are cached by name, along with their attributes once loaded, for
+    `queue_cache_ttl` seconds (forever by default), so that publishing to a queue
+    does not look it up every time.
+
+    Batches of messages are packed into as few calls as the limits of SQS allow
+    (10 entries and `max_batch_bytes` bytes per call). Messages larger than
+    `max_batch_bytes` are not sent, since SQS would reject them even on their own;
+    they are reported as failed with a `MessageTooLong` error.
     """
 
     def __init__(self, **kwargs: Any) -> None:
@@ -25,6 +44,10 @@ class BaseSQSBackend(MessagingBackend):
 
         self.extra_settings = kwargs.get("extra_settings", {})
         self.sns_settings = kwargs.get("sns_settings", {})
+        self._queues = LocalCache(ttl=kwargs.get("queue_cache_ttl") or math.inf)
+        self._batch_builder = BatchBuilder(
+            max_bytes=kwargs.get("max_batch_bytes", MAX_BATCH_BYTES)
+        )
 
     def declare_topic(self, topic_name: str) -> TopicWrapper:
         sns = boto3.resource("sns", **self.sns_settings)
@@ -32,8 +55,12 @@ class BaseSQSBackend(MessagingBackend):
         return TopicWrapper(topic)
 
     def get_queue(self, queue_name: str) -> QueueWrapper:
-        sqs_res = boto3.resource("sqs", **self.extra_settings)
-        return QueueWrapper(sqs_res.get_queue_by_name(QueueName=queue_name))
+        queue = self._queues.get(queue_name)
+        if queue is None:
+            sqs_res = boto3.resource("sqs", **self.extra_settings)
+            queue = QueueWrapper(sqs_res.get_queue_by_name(QueueName=queue_name))
+            self._queues.put(queue_name, queue)
+        return queue
 
     def _subscribe_to_topics(
         self, queue: QueueWrapper, topics_to_bind: Iterable[TopicWrapper], **kwargs: Any
@@ -115,6 +142,8 @@ class BaseSQSBackend(MessagingBackend):
                 Attributes={"RedrivePolicy": json.dumps(redrive_policy)}
             )
 
+        # The attributes of the queue may have changed, so load them afresh next time
+        self._queues.discard(queue_name)
         return queue, dead_letter_queue
 
     def _create_queue(self, queue_name: str, **kwargs: Any) -> QueueWrapper:
@@ -147,6 +176,12 @@ class BaseSQSBackend(MessagingBackend):
         return [self._construct_message(message) for message in messages]
 
     def yield_messages(self, queue: QueueWrapper, **kwargs: Any) -> Iterable[Message]:
+        for messages in self.yield_batches(queue, **kwargs):
+            yield from messages
+
+    def yield_batches(
+        self, queue: QueueWrapper, **kwargs: Any
+    ) -> Iterable[List[Message]]:
         args = dict(
             MaxNumberOfMessages=self.max_number_of_messages,
             VisibilityTimeout=self.visibility_timeout,
@@ -157,9 +192,9 @@ class BaseSQSBackend(MessagingBackend):
 
         while True:
             messages = queue.unwrapped_obj.receive_messages(**args)
-            for message_content in messages:
-                message = self._construct_message(message_content)
-                yield message
+            yield [
+                self._construct_message(message_content) for message_content in messages
+            ]
 
     def publish_to_queue(
         self, message: Message, queue: QueueWrapper, **kwargs: Any
@@ -193,15 +228,15 @@ class BaseSQSBackend(MessagingBackend):
 
     def publish_to_queue_batch(
         self, message_dtos: List[MessageDto], queue: QueueWrapper
-    ) -> None:
+    ) -> List[PublishResult]:
         entries: List[Dict[str, Any]] = []
+        is_fifo = queue.unwrapped_obj.attributes.get("FifoQueue") == "true"
 
         for message_dto in message_dtos:
             message = message_dto.message
             entry: Dict = {}
             entry["MessageBody"] = json.dumps({"Message": message.content})
 
-            is_fifo = queue.unwrapped_obj.attributes.get("FifoQueue") == "true"
             message_deduplication_id = (
                 None
                 if not is_fifo
@@ -226,7 +261,14 @@ class BaseSQSBackend(MessagingBackend):
             entry["Id"] = str(uuid.uuid4())
             entries.append(entry)
 
-        queue.unwrapped_obj.send_messages(Entries=entries)
+        sendable, oversized = self._batch_builder.reject_oversized(entries)
+        outcomes = {outcome["Id"]: outcome for outcome in oversized}
+        for batch in self._batch_builder.build(sendable, ordered=is_fifo):
+            response = queue.unwrapped_obj.send_messages(Entries=batch)
+            for outcome in response.get("Successful", []) + response.get("Failed", []):
+                outcomes[outcome["Id"]] = outcome
+
+        return _to_publish_results(message_dtos, entries, outcomes)
 
     def publish_to_topic(
         self,
@@ -266,11 +308,59 @@ class BaseSQSBackend(MessagingBackend):
     def acknowledge(self, message: Message) -> None:
         message.metadata.delete()
 
+    def acknowledge_batch(self, messages: List[Message]) -> None:
+        messages_by_queue = funcy.group_by(lambda m: m.metadata.queue_url, messages)
+        for queue_url, queue_messages in messages_by_queue.items():
+            client = queue_messages[0].metadata.meta.client
+            failed = []
+            for chunk in funcy.chunks(10, queue_messages):
+                receipt_handles = {
+                    str(uuid.uuid4()): message.metadata.receipt_handle
+                    for message in chunk
+                }
+                response = client.delete_message_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {"Id": id, "ReceiptHandle": receipt_handle}
+                        for id, receipt_handle in receipt_handles.items()
+                    ],
+                )
+                failed += [
+                    receipt_handles[failure["Id"]]
+                    for failure in response.get("Failed", [])
+                ]
+
+            if failed:
+                logger.warning(
+                    f"Could not acknowledge {len(failed)} messages of the queue "
+                    f"{queue_url}: {failed}"
+                )
+
+    def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        messages_by_queue = funcy.group_by(lambda m: m.metadata.queue_url, messages)
+        for queue_url, queue_messages in messages_by_queue.items():
+            client = queue_messages[0].metadata.meta.client
+            for chunk in funcy.chunks(10, queue_messages):
+                client.change_message_visibility_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {
+                            "Id": str(uuid.uuid4()),
+                            "ReceiptHandle": message.metadata.receipt_handle,
+                            "VisibilityTimeout": visibility_timeout,
+                        }
+                        for message in chunk
+                    ],
+                )
+
     def close_connection(self) -> None:
         pass
 
     def delete_queue(self, queue: QueueWrapper) -> None:
         queue.unwrapped_obj.delete()
+        self._queues.discard(_get_queue_name(queue.unwrapped_obj.url))
 
     def delete_topic(self, topic: TopicWrapper) -> None:
         topic.unwrapped_obj.delete()
@@ -327,3 +417,36 @@ class AWSBackend(BaseSQSBackend):
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
+
+
+def _get_queue_name(queue_url: str) -> str:
+    return queue_url.rsplit("/", 1)[-1]
+
+
+def _to_publish_results(
+    message_dtos: List[MessageDto], entries: List[Dict], outcomes: Dict[str, Dict]
+) -> List[PublishResult]:
+    """
+    Matches the messages with the outcome of their entries in a batch response
+    """
+    results = []
+    for message_dto, entry in zip(message_dtos, entries):
+        outcome = outcomes[entry["Id"]]
+        if "MessageId" in outcome:
+            results.append(PublishResult(message_dto, outcome["MessageId"]))
+        else:
+            error = f"{outcome.get('Code')}: {outcome.get('Message', '')}"
+            results.append(PublishResult(message_dto, error=error))
+
+    return results
+
+
+def _to_failed_entries(entries: List[Dict], error: Exception) -> List[Dict]:
+    """
+    Fails all the entries of a batch call that raised, as in the `Failed` list
+    of a batch response
+    """
+    return [
+        {"Id": entry["Id"], "Code": type(error).__name__, "Message": str(error)}
+        for entry in entries
+    ]
@@ -1,14 +1,43 @@
 import json
 import logging
+import math
+import random
 import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from json import JSONDecodeError
-from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple
+from types import TracebackType
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
 import aioboto3
+import anyio
 import funcy
+from aiobotocore.config import AioConfig
 
 from melange.backends.interfaces import AsyncMessagingBackend
-from melange.models import Message, MessageDto, QueueWrapper, TopicWrapper
+from melange.backends.sqs.batch_builder import MAX_BATCH_BYTES, BatchBuilder
+from melange.backends.sqs.sqs_backend import (
+    _get_queue_name,
+    _to_failed_entries,
+    _to_publish_results,
+)
+from melange.infrastructure.cache import LocalCache
+from melange.models import (
+    Message,
+    MessageDto,
+    PublishResult,
+    QueueWrapper,
+    TopicWrapper,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +45,27 @@ logger = logging.getLogger(__name__)
 class AsyncBaseSQSBackend(AsyncMessagingBackend):
     """
     Base class for async SQS Backends.
+
+    Use the backend as an async context manager (or call `start` and `close`) to
+    keep long-lived SQS and SNS clients, each with a pool of up to
+    `max_pool_connections` connections (unless the `config` of the settings sets
+    its own), for all the calls in between. Otherwise, every call opens and closes
+    a client of its own.
+
+    The queues are cached by name, along with their immutable attributes (whether
+    they are FIFO and their ARN), for `queue_cache_ttl` seconds (forever by
+    default), so that publishing to a queue does not look it up every time.
+
+    The batch APIs are called in chunks of 10 entries, up to `batch_concurrency`
+    chunks at a time. The entries that fail for reasons other than the request
+    itself are retried up to `batch_retries` times, with a jittered exponential
+    backoff starting at `batch_backoff` seconds.
+
+    Batches of messages are packed into as few calls as the limits of SQS allow
+    (10 entries and `max_batch_bytes` bytes per call). Messages larger than
+    `max_batch_bytes` are not sent, since SQS would reject them even on their own;
+    they are reported as failed with a `MessageTooLong` error. The batches of FIFO
+    queues are sent one after another, so that the messages keep their order.
     """
 
     def __init__(self, **kwargs: Any) -> None:
@@ -26,28 +76,119 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
 
         self.extra_settings = kwargs.get("extra_settings", {})
         self.sns_settings = kwargs.get("sns_settings", {})
+        self.max_pool_connections = kwargs.get("max_pool_connections", 10)
         self.session = aioboto3.Session()
+        self._clients: Dict[str, Any] = {}
+        queue_cache_ttl = kwargs.get("queue_cache_ttl") or math.inf
+        self._queues = LocalCache(ttl=queue_cache_ttl)
+        self._queue_attributes = LocalCache(ttl=queue_cache_ttl)
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self.batch_concurrency = kwargs.get("batch_concurrency", 10)
+        self.batch_retries = kwargs.get("batch_retries", 3)
+        self.batch_backoff = kwargs.get("batch_backoff", 0.1)
+        self._batch_builder = BatchBuilder(
+            max_bytes=kwargs.get("max_batch_bytes", MAX_BATCH_BYTES)
+        )
+
+    async def start(self) -> None:
+        """
+        Opens the long-lived SQS and SNS clients
+        """
+        if self._exit_stack:
+            return
+
+        async with AsyncExitStack() as stack:
+            for service, settings in [
+                ("sqs", self.extra_settings),
+                ("sns", {**self.extra_settings, **self.sns_settings}),
+            ]:
+                settings = dict(settings)
+                user_config = settings.get("config")
+                config = AioConfig(
+                    getattr(user_config, "connector_args", None),
+                    max_pool_connections=self.max_pool_connections,
+                )
+                # The options set in the config of the settings take precedence
+                settings["config"] = (
+                    config.merge(user_config) if user_config else config
+                )
+                self._clients[service] = await stack.enter_async_context(
+                    self.session.client(service, **settings)
+                )
+            self._exit_stack = stack.pop_all()
+
+    async def close(self) -> None:
+        """
+        Closes the long-lived clients
+        """
+        stack, self._exit_stack = self._exit_stack, None
+        self._clients = {}
+        if stack:
+            await stack.aclose()
+
+    async def __aenter__(self) -> "AsyncBaseSQSBackend":
+        await self.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    @asynccontextmanager
+    async def _client(self, service: str, settings: Dict) -> AsyncIterator[Any]:
+        """
+        Provides the long-lived client of the service if the backend has been
+        started, or a client just for this call otherwise
+        """
+        client = self._clients.get(service)
+        if client:
+            yield client
+            return
+
+        async with self.session.client(service, **settings) as client:
+            yield client
 
     async def declare_topic(self, topic_name: str) -> TopicWrapper:
-        async with self.session.client("sns", **self.sns_settings) as sns:
+        async with self._client("sns", self.sns_settings) as sns:
             topic = await sns.create_topic(Name=topic_name)
             return TopicWrapper(topic)
 
     async def get_queue(self, queue_name: str) -> QueueWrapper:
-        async with self.session.resource("sqs", **self.extra_settings) as sqs:
-            queue = await sqs.get_queue_by_name(QueueName=queue_name)
-            return QueueWrapper(queue)
+        queue = self._queues.get(queue_name)
+        if queue is None:
+            async with self.session.resource("sqs", **self.extra_settings) as sqs:
+                queue = QueueWrapper(await sqs.get_queue_by_name(QueueName=queue_name))
+            self._queues.put(queue_name, queue)
+        return queue
 
     async def get_queue_attributes(self, queue: QueueWrapper) -> Dict:
-        async with self.session.client("sqs", **self.extra_settings) as sqs:
+        async with self._client("sqs", self.extra_settings) as sqs:
             return (
                 await sqs.get_queue_attributes(
                     QueueUrl=queue.unwrapped_obj.url, AttributeNames=["All"]
                 )
             )["Attributes"]
 
+    async def _get_immutable_attributes(self, queue: QueueWrapper) -> Dict:
+        """
+        Returns the attributes of the queue that cannot change, so they can be
+        cached: whether the queue is FIFO, and its ARN
+        """
+        queue_url = queue.unwrapped_obj.url
+        attributes = self._queue_attributes.get(queue_url)
+        if attributes is None:
+            attributes = funcy.project(
+                await self.get_queue_attributes(queue), ["FifoQueue", "QueueArn"]
+            )
+            self._queue_attributes.put(queue_url, attributes)
+        return attributes
+
     async def set_queue_attributes(self, queue: QueueWrapper, attributes: Dict) -> None:
-        async with self.session.client("sqs", **self.extra_settings) as sqs:
+        async with self._client("sqs", self.extra_settings) as sqs:
             await sqs.set_queue_attributes(
                 QueueUrl=queue.unwrapped_obj.url, Attributes=attributes
             )
@@ -55,7 +196,7 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
     async def _subscribe_to_topics(
         self, queue: QueueWrapper, topics_to_bind: Iterable[TopicWrapper], **kwargs: Any
     ) -> None:
-        async with self.session.client("sns", **self.extra_settings) as sns:
+        async with self._client("sns", self.extra_settings) as sns:
             attributes = await self.get_queue_attributes(queue)
             if topics_to_bind:
                 statements = []
@@ -127,7 +268,7 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
                     dead_letter_queue_name, content_based_deduplication="true"
                 )
 
-            attributes = await self.get_queue_attributes(dead_letter_queue)
+            attributes = await self._get_immutable_attributes(dead_letter_queue)
 
             redrive_policy = {
                 "deadLetterTargetArn": attributes["QueueArn"],
@@ -168,7 +309,7 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
         if "attempt_id" in kwargs:
             args["ReceiveRequestAttemptId"] = kwargs["attempt_id"]
 
-        async with self.session.client("sqs", **self.extra_settings) as client:
+        async with self._client("sqs", self.extra_settings) as client:
             messages = await client.receive_message(
                 QueueUrl=queue.unwrapped_obj.url, **args
             )
@@ -189,7 +330,7 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
         message_args: Dict = {}
         message_args["MessageBody"] = json.dumps({"Message": message.content})
 
-        attributes = await self.get_queue_attributes(queue)
+        attributes = await self._get_immutable_attributes(queue)
         is_fifo = attributes.get("FifoQueue") == "true"
         message_deduplication_id = (
             None
@@ -212,53 +353,136 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
         if message_deduplication_id:
             message_args["MessageDeduplicationId"] = message_deduplication_id
 
-        async with self.session.client("sqs", **self.extra_settings) as client:
+        async with self._client("sqs", self.extra_settings) as client:
             await client.send_message(QueueUrl=queue.unwrapped_obj.url, **message_args)
 
     async def publish_to_queue_batch(
         self, message_dtos: List[MessageDto], queue: QueueWrapper
-    ) -> None:
-        attributes = await self.get_queue_attributes(queue)
-        for chunk in funcy.chunks(10, message_dtos):
-            entries: List[Dict[str, Any]] = []
-
-            for message_dto in chunk:
-                message = message_dto.message
-                entry: Dict = {}
-                entry["MessageBody"] = json.dumps({"Message": message.content})
-
-                is_fifo = attributes.get("FifoQueue") == "true"
-                message_deduplication_id = (
-                    None
-                    if not is_fifo
-                    else (message_dto.message_deduplication_id or str(uuid.uuid4()))
-                )
+    ) -> List[PublishResult]:
+        attributes = await self._get_immutable_attributes(queue)
+        is_fifo = attributes.get("FifoQueue") == "true"
+        entries = [
+            self._build_batch_entry(message_dto, is_fifo)
+            for message_dto in message_dtos
+        ]
+
+        sendable, oversized = self._batch_builder.reject_oversized(entries)
+        outcomes = await self._call_batches(
+            "send_message_batch",
+            {queue.unwrapped_obj.url: self._batch_builder.build(sendable, is_fifo)},
+            ordered=is_fifo,
+        )
+        outcomes.update((outcome["Id"], outcome) for outcome in oversized)
+
+        results = _to_publish_results(message_dtos, entries, outcomes)
+        failed = sum(not result.succeeded for result in results)
+        if failed:
+            logger.warning(
+                f"Could not publish {failed} of {len(results)} messages "
+                f"to the queue {queue.unwrapped_obj.url}"
+            )
 
-                if message.manifest:
-                    entry["MessageAttributes"] = {
-                        "manifest": {
-                            "DataType": "String",
-                            "StringValue": message.manifest,
-                        },
-                        "serializer_id": {
-                            "DataType": "Number",
-                            "StringValue": str(message.serializer_id),
-                        },
-                    }
+        return results
+
+    def _build_batch_entry(self, message_dto: MessageDto, is_fifo: bool) -> Dict:
+        message = message_dto.message
+        entry: Dict = {}
+        entry["MessageBody"] = json.dumps({"Message": message.content})
+
+        message_deduplication_id = (
+            None
+            if not is_fifo
+            else (message_dto.message_deduplication_id or str(uuid.uuid4()))
+        )
 
-                if message_dto.message_group_id:
-                    entry["MessageGroupId"] = message_dto.message_group_id
+        if message.manifest:
+            entry["MessageAttributes"] = {
+                "manifest": {
+                    "DataType": "String",
+                    "StringValue": message.manifest,
+                },
+                "serializer_id": {
+                    "DataType": "Number",
+                    "StringValue": str(message.serializer_id),
+                },
+            }
 
-                if message_deduplication_id:
-                    entry["MessageDeduplicationId"] = message_deduplication_id
+        if message_dto.message_group_id:
+            entry["MessageGroupId"] = message_dto.message_group_id
 
-                entry["Id"] = str(uuid.uuid4())
-                entries.append(entry)
+        if message_deduplication_id:
+            entry["MessageDeduplicationId"] = message_deduplication_id
 
-            async with self.session.client("sqs", **self.extra_settings) as client:
-                await client.send_message_batch(
-                    QueueUrl=queue.unwrapped_obj.url, Entries=entries
-                )
+        entry["Id"] = str(uuid.uuid4())
+        return entry
+
+    async def _call_batches(
+        self,
+        operation: str,
+        batches_by_queue: Dict[str, List[List[Dict]]],
+        ordered: bool = False,
+    ) -> Dict[str, Dict]:
+        """
+        Calls the `operation` batch API of every queue (by URL) with its batches
+        of entries, sent concurrently unless they must keep their order
+        (`ordered`), retrying the entries that failed but may succeed later.
+        A call that raises (throttling, server or network errors) fails all the
+        entries of its batch, which are retried as well.
+
+        Returns the outcome of every entry by its id: its entry of either the
+        `Successful` or the `Failed` list of the last response that included it,
+        or a failure with the error raised by the last call
+        """
+        outcomes: Dict[str, Dict] = {}
+        limiter = anyio.CapacityLimiter(self.batch_concurrency)
+
+        async def call(client: Any, queue_url: str, chunk: List[Dict]) -> None:
+            for attempt in range(self.batch_retries + 1):
+                if attempt:
+                    # Full jitter, so that the retries of every chunk spread out
+                    await anyio.sleep(
+                        random.uniform(0, self.batch_backoff * 2 ** (attempt - 1))
+                    )
+
+                async with limiter:
+                    try:
+                        response = await getattr(client, operation)(
+                            QueueUrl=queue_url, Entries=chunk
+                        )
+                    except Exception as e:
+                        logger.warning(f"The batch call to {queue_url} failed: {e}")
+                        response = {"Failed": _to_failed_entries(chunk, e)}
+
+                for successful in response.get("Successful", []):
+                    outcomes[successful["Id"]] = successful
+
+                retryable = set()
+                for failed in response.get("Failed", []):
+                    outcomes[failed["Id"]] = failed
+                    if not failed.get("SenderFault"):
+                        retryable.add(failed["Id"])
+
+                chunk = [entry for entry in chunk if entry["Id"] in retryable]
+                if not chunk:
+                    return
+
+        async def call_in_order(
+            client: Any, queue_url: str, batches: List[List[Dict]]
+        ) -> None:
+            for batch in batches:
+                await call(client, queue_url, batch)
+
+        async with self._client("sqs", self.extra_settings) as client:
+            async with anyio.create_task_group() as tg:
+                for queue_url, batches in batches_by_queue.items():
+                    if ordered:
+                        tg.start_soon(call_in_order, client, queue_url, batches)
+                        continue
+
+                    for batch in batches:
+                        tg.start_soon(call, client, queue_url, batch)
+
+        return outcomes
 
     async def publish_to_topic(
         self,
@@ -290,7 +514,7 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
             if "message_structure" in extra_attributes:
                 args["MessageStructure"] = extra_attributes["message_structure"]
 
-        async with self.session.client("sns", **self.extra_settings) as sns:
+        async with self._client("sns", self.extra_settings) as sns:
             response = await sns.publish(
                 TopicArn=topic.unwrapped_obj["TopicArn"], **args
             )
@@ -299,30 +523,71 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
             raise ConnectionError("Could not send the event to the SNS TOPIC")
 
     async def acknowledge(self, message: Message) -> None:
-        async with self.session.client("sqs", **self.extra_settings) as client:
+        async with self._client("sqs", self.extra_settings) as client:
             await client.delete_message(
                 QueueUrl=message.metadata["QueueUrl"],
                 ReceiptHandle=message.metadata["ReceiptHandle"],
             )
 
     async def acknowledge_batch(self, messages: List[Message]) -> None:
-        if not messages:
+        await self._call_message_batches(
+            "delete_message_batch", messages, "acknowledge"
+        )
+
+    async def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        await self._call_message_batches(
+            "change_message_visibility_batch",
+            messages,
+            "change the visibility of",
+            VisibilityTimeout=visibility_timeout,
+        )
+
+    async def _call_message_batches(
+        self, operation: str, messages: List[Message], action: str, **params: Any
+    ) -> None:
+        """
+        Calls the `operation` batch API with the receipt handles of the messages,
+        grouped by the queue they came from, and logs the receipt handles that
+        could not be processed
+        """
+        entries_by_queue: Dict[str, List[Dict]] = {}
+        for message in messages:
+            entries_by_queue.setdefault(message.metadata["QueueUrl"], []).append(
+                {
+                    "Id": str(uuid.uuid4()),
+                    "ReceiptHandle": message.metadata["ReceiptHandle"],
+                    **params,
+                }
+            )
+
+        if not entries_by_queue:
             return
 
-        queue_url = messages[0].metadata["QueueUrl"]
-        async with self.session.client("sqs", **self.extra_settings) as client:
-            for chunk in funcy.chunks(10, messages):
-                await client.delete_message_batch(
-                    QueueUrl=queue_url,
-                    Entries=[
-                        {
-                            "Id": str(uuid.uuid4()),
-                            "ReceiptHandle": message.metadata["ReceiptHandle"],
-                        }
-                        for message in chunk
-                    ],
+        outcomes = await self._call_batches(
+            operation,
+            {
+                queue_url: list(funcy.chunks(10, entries))
+                for queue_url, entries in entries_by_queue.items()
+            },
+        )
+
+        for queue_url, entries in entries_by_queue.items():
+            failed = [
+                entry["ReceiptHandle"]
+                for entry in entries
+                if "Code" in outcomes[entry["Id"]]
+            ]
+            if failed:
+                logger.warning(
+                    f"Could not {action} {len(failed)} messages of the queue "
+                    f"{queue_url}: {failed}"
                 )
 
+    def get_message_group(self, message: Message) -> Optional[str]:
+        return message.metadata.get("Attributes", {}).get("MessageGroupId")
+
     def close_connection(self) -> None:
         pass
 
@@ -332,16 +597,22 @@ class AsyncBaseSQSBackend(AsyncMessagingBackend):
         so it is useful to have this kind of method which, given a name,
         gives you back the URL
         """
-        async with self.session.client("sqs", **self.extra_settings) as client:
+        queue = self._queues.get(queue_name)
+        if queue is not None:
+            return queue.unwrapped_obj.url
+
+        async with self._client("sqs", self.extra_settings) as client:
             response = await client.get_queue_url(QueueName=queue_name)
             return response["QueueUrl"]
 
     async def delete_queue(self, queue: QueueWrapper) -> None:
-        async with self.session.client("sqs", **self.extra_settings) as client:
+        async with self._client("sqs", self.extra_settings) as client:
             await client.delete_queue(QueueUrl=queue.unwrapped_obj.url)
+        self._queues.discard(_get_queue_name(queue.unwrapped_obj.url))
+        self._queue_attributes.discard(queue.unwrapped_obj.url)
 
     async def delete_topic(self, topic: TopicWrapper) -> None:
-        async with self.session.client("sns", **self.extra_settings) as client:
+        async with self._client("sns", self.extra_settings) as client:
             await client.delete_topic(TopicArn=topic.unwrapped_obj["TopicArn"])
 
     def _construct_message_from_raw(self, message: Dict, queue_url: str) -> Message:
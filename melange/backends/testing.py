@@ -3,7 +3,13 @@ from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from melange.backends.interfaces import MessagingBackend
 from melange.consumers import Consumer
 from melange.message_dispatcher import MessageDispatcher
-from melange.models import Message, MessageDto, QueueWrapper, TopicWrapper
+from melange.models import (
+    Message,
+    MessageDto,
+    PublishResult,
+    QueueWrapper,
+    TopicWrapper,
+)
 from melange.serializers.registry import SerializerRegistry
 
 
@@ -58,6 +64,12 @@ class InMemoryMessagingBackend(MessagingBackend):
         for message in self._messages:
             yield message
 
+    def yield_batches(
+        self, queue: QueueWrapper, **kwargs: Any
+    ) -> Iterable[List[Message]]:
+        if self._messages:
+            yield list(self._messages)
+
     def publish_to_topic(
         self,
         message: Message,
@@ -85,13 +97,23 @@ class InMemoryMessagingBackend(MessagingBackend):
 
     def publish_to_queue_batch(
         self, message_dtos: List[MessageDto], queue: QueueWrapper
-    ) -> None:
+    ) -> List[PublishResult]:
         for message in message_dtos:
             self.publish_to_queue(message.message, queue)
 
+        return [PublishResult(message_dto) for message_dto in message_dtos]
+
     def acknowledge(self, message: Message) -> None:
         return None
 
+    def acknowledge_batch(self, messages: List[Message]) -> None:
+        return None
+
+    def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        return None
+
     def delete_queue(self, queue: QueueWrapper) -> None:
         return None
 
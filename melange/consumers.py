@@ -14,8 +14,13 @@ class Consumer:
     You could use is as is and supply a `on_message` callable to process your messages.
     Though commonly you would inherit this class, create your own consumer and
     override the `process` and `accepts` methods.
+
+    Set `accepts_by_type` to `True` if the result of `accepts` depends only on the
+    type of the message, so that the dispatchers can cache it per message type.
     """
 
+    accepts_by_type: bool = False
+
     def __init__(self, on_message: Optional[Callable[[Any], None]] = None) -> None:
         self._on_message = on_message
 
@@ -49,8 +54,13 @@ class AsyncConsumer:
     You could use is as is and supply a `on_message` callable to process your messages.
     Though commonly you would inherit this class, create your own consumer and
     override the `process` and `accepts` methods.
+
+    Set `accepts_by_type` to `True` if the result of `accepts` depends only on the
+    type of the message, so that the dispatchers can cache it per message type.
     """
 
+    accepts_by_type: bool = False
+
     def __init__(self, on_message: Optional[MessageCallable] = None) -> None:
         self._on_message = on_message
 
@@ -75,9 +85,19 @@ class SingleDispatchConsumer(Consumer, SingleDispatch):
     """
     This class can consume events from a queue and pass them to a processor
     through the means of method overloading. Provides a default implementation as well for
-    the accepts method
+    the accepts method. Since the messages are accepted by their type, the dispatchers
+    cache the result of `accepts` per message type, unless a subclass overrides
+    `accepts`. Such a subclass may still set `accepts_by_type` to `True`.
     """
 
+    accepts_by_type = True
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # An overridden `accepts` may inspect the values of the messages
+        if "accepts" in vars(cls) and "accepts_by_type" not in vars(cls):
+            cls.accepts_by_type = False
+
     def process(self, message: Any, **kwargs: Any) -> None:
         self._process(message)
 
@@ -95,9 +115,19 @@ class AsyncSingleDispatchConsumer(AsyncConsumer, SingleDispatch):
     """
     This class can consume events from a queue and pass them to a processor
     through the means of method overloading. Provides a default implementation as well for
-    the accepts method
+    the accepts method. Since the messages are accepted by their type, the dispatchers
+    cache the result of `accepts` per message type, unless a subclass overrides
+    `accepts`. Such a subclass may still set `accepts_by_type` to `True`.
     """
 
+    accepts_by_type = True
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # An overridden `accepts` may inspect the values of the messages
+        if "accepts" in vars(cls) and "accepts_by_type" not in vars(cls):
+            cls.accepts_by_type = False
+
     async def process(self, message: Any, **kwargs: Any) -> None:
         await self._process(message)
 
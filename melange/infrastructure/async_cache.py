@@ -1,9 +1,22 @@
 import logging
-from typing import Any, Optional, Protocol
+from typing import Any, Dict, List, Optional, Protocol, Set, cast
 
 import redis.exceptions
 from redis import asyncio as aioredis  # type: ignore
 
+from melange.infrastructure.bloom_cache import (
+    BloomFilter,
+    LocalBitmaps,
+    RotatingWindows,
+)
+from melange.infrastructure.cache import (
+    CLAIM_SCRIPT,
+    DEFAULT_DEDUPLICATION_WINDOW,
+    PROCESSING_MARKER,
+    ClaimResult,
+    LocalCache,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -32,6 +45,60 @@ class AsyncDeduplicationCache(Protocol):
     async def contains(self, key: str) -> bool:
         raise NotImplementedError
 
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        """
+        Checks whether each of the keys is present in the store, in one go
+
+        Args:
+            keys: the keys to check
+
+        Returns:
+            A list with the presence of each key, in the same order as `keys`
+        """
+        raise NotImplementedError
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        """
+        Stores several keys into the cache, in one go
+        Args:
+            items: the keys to store along with their values
+            expire: expiration time in seconds
+        """
+        raise NotImplementedError
+
+
+class AsyncClaimingDeduplicationCache(AsyncDeduplicationCache, Protocol):
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        """
+        Atomically claims a key for processing, unless it is already present
+        Args:
+            key: the key to claim
+            ttl: seconds after which the claim is lost if not confirmed,
+                in case the processing never finishes
+
+        Returns:
+            Whether the key has been claimed, or otherwise why not
+        """
+        raise NotImplementedError
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        """
+        Stores the value of a claimed key, once the processing has succeeded
+        Args:
+            key:
+            value:
+            expire: expiration time in seconds
+        """
+        raise NotImplementedError
+
+    async def release(self, key: str) -> None:
+        """
+        Gives up a claimed key, so that the message can be processed again
+        """
+        raise NotImplementedError
+
 
 class AsyncNullCache:
     """
@@ -47,8 +114,30 @@ class AsyncNullCache:
     async def contains(self, key: str) -> bool:
         return False
 
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        return [False] * len(keys)
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        pass
+
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        return ClaimResult.CLAIMED
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        pass
+
+    async def release(self, key: str) -> None:
+        pass
+
 
 class AsyncRedisCache:
+    """
+    A deduplication cache on Redis. Keys are stored for `expire` seconds
+    unless an expiration is given explicitly.
+    """
+
     def __init__(self, **kwargs: Any) -> None:
         self.client = aioredis.Redis(
             host=kwargs.get("host"),
@@ -57,9 +146,11 @@ class AsyncRedisCache:
             password=kwargs.get("password"),
             decode_responses=True,
         )
+        self.expire = kwargs.get("expire", DEFAULT_DEDUPLICATION_WINDOW)
+        self._claim = self.client.register_script(CLAIM_SCRIPT)
 
     async def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        return await self.client.set(key, value, expire)
+        return await self.client.set(key, value, expire or self.expire)
 
     async def get(self, key: str) -> Any:
         return await self.client.get(key)
@@ -67,6 +158,257 @@ class AsyncRedisCache:
     async def contains(self, key: str) -> bool:
         return bool(await self.client.exists(key))
 
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        if not keys:
+            return []
+        return [value is not None for value in await self.client.mget(keys)]
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        if not items:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, expire or self.expire)
+            await pipe.execute()
+
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        return ClaimResult(await self._claim(keys=[key], args=[PROCESSING_MARKER, ttl]))
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        await self.client.set(key, value, expire or self.expire)
+
+    async def release(self, key: str) -> None:
+        await self.client.delete(key)
+
+    async def count_keys(self, pattern: str = "*") -> int:
+        """
+        Counts the live keys matching the pattern, e.g. `"myapp.consumers.*"`
+        for the deduplication keys of the consumers of a module. Counting all
+        the keys is cheap, any other pattern scans the whole keyspace.
+        """
+        if pattern == "*":
+            return await self.client.dbsize()
+        return len(
+            [key async for key in self.client.scan_iter(match=pattern, count=1000)]
+        )
+
+
+class AsyncDeduplicationBatch:
+    """
+    A view over an `AsyncDeduplicationCache` for a batch of messages. Call `load`
+    to check the presence of all the keys of the batch with one `contains_many`
+    call. The keys stored through this view are buffered until `flush` writes
+    them back with a single `store_many` call.
+
+    Claims, confirmations and releases go straight to the underlying cache, which
+    must then be an `AsyncClaimingDeduplicationCache`: only the cache can tell a
+    key being processed by another worker from a processed one.
+    """
+
+    def __init__(self, cache: AsyncDeduplicationCache) -> None:
+        self._cache = cache
+        self._present: Set[str] = set()
+        self._pending: Dict[str, Any] = {}
+        self._expire: Optional[int] = None
+
+    async def load(self, keys: List[str]) -> None:
+        self._present = {
+            key
+            for key, present in zip(keys, await self._cache.contains_many(keys))
+            if present
+        }
+
+    async def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self._pending[key] = value
+        self._expire = expire
+
+    async def get(self, key: str) -> Any:
+        if key in self._pending:
+            return self._pending[key]
+        return await self._cache.get(key)
+
+    async def contains(self, key: str) -> bool:
+        return key in self._present or key in self._pending
+
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        return [await self.contains(key) for key in keys]
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        for key, value in items.items():
+            await self.store(key, value, expire)
+
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        return await cast(AsyncClaimingDeduplicationCache, self._cache).claim(key, ttl)
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        await cast(AsyncClaimingDeduplicationCache, self._cache).confirm(
+            key, value, expire
+        )
+
+    async def release(self, key: str) -> None:
+        await cast(AsyncClaimingDeduplicationCache, self._cache).release(key)
+
+    async def flush(self) -> None:
+        """
+        Writes the buffered keys back to the underlying cache
+        """
+        pending, self._pending = self._pending, {}
+        await self._cache.store_many(pending, self._expire)
+
+
+class AsyncTieredDeduplicationCache:
+    """
+    Puts a `LocalCache` in front of another cache, usually an `AsyncRedisCache`.
+    The keys known to be present are answered locally, so that a duplicate arriving
+    shortly after the original at the same process does not hit the underlying
+    cache. Absent keys are always checked against the underlying cache, and all
+    the writes go through to it.
+    """
+
+    def __init__(
+        self, cache: AsyncDeduplicationCache, max_size: int = 10000, ttl: float = 60
+    ) -> None:
+        self._cache = cache
+        self.local = LocalCache(max_size, ttl)
+
+    async def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        await self._cache.store(key, value, expire)
+        self.local.put(key, value, expire)
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is None:
+            value = await self._cache.get(key)
+            if value is not None:
+                self.local.put(key, value)
+        return value
+
+    async def contains(self, key: str) -> bool:
+        if key in self.local:
+            return True
+        if await self._cache.contains(key):
+            self.local.put(key)
+            return True
+        return False
+
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        presence = {key: True for key in keys if key in self.local}
+        missing = [key for key in keys if key not in presence]
+        for key, present in zip(missing, await self._cache.contains_many(missing)):
+            presence[key] = present
+            if present:
+                self.local.put(key)
+        return [presence[key] for key in keys]
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        await self._cache.store_many(items, expire)
+        for key, value in items.items():
+            self.local.put(key, value, expire)
+
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        if key in self.local:
+            return ClaimResult.PROCESSED
+        return await cast(AsyncClaimingDeduplicationCache, self._cache).claim(key, ttl)
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        await cast(AsyncClaimingDeduplicationCache, self._cache).confirm(
+            key, value, expire
+        )
+        self.local.put(key, value, expire)
+
+    async def release(self, key: str) -> None:
+        self.local.discard(key)
+        await cast(AsyncClaimingDeduplicationCache, self._cache).release(key)
+
+    async def count_keys(self, pattern: str = "*") -> int:
+        """
+        Counts the live keys of the underlying cache
+        (see `AsyncRedisCache.count_keys`)
+        """
+        return await cast(AsyncRedisCache, self._cache).count_keys(pattern)
+
+
+class AsyncBloomFilterCache:
+    """
+    The asynchronous version of the `BloomFilterCache`: a deduplication cache with
+    bounded memory that keeps a Bloom filter per time window, either in process
+    memory or, if a Redis `client` is supplied, as Redis bitmaps. An `expire`
+    longer than the windows can keep the keys raises a ValueError.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000000,
+        error_rate: float = 0.001,
+        window: int = 3600,
+        windows: int = 2,
+        client: Optional[aioredis.Redis] = None,
+        key_prefix: str = "melange:dedup",
+    ) -> None:
+        self.filter = BloomFilter(capacity, error_rate)
+        self.windows = RotatingWindows(window, windows)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._local = LocalBitmaps(self.filter.size)
+
+    async def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        await self.store_many({key: value}, expire)
+
+    async def get(self, key: str) -> Any:
+        return None
+
+    async def contains(self, key: str) -> bool:
+        return (await self.contains_many([key]))[0]
+
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        if not keys:
+            return []
+
+        windows = self.windows.live()
+        if not self.client:
+            return [
+                self._local.test(windows, self.filter.positions(key)) for key in keys
+            ]
+
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                for window in windows:
+                    for position in self.filter.positions(key):
+                        pipe.getbit(self._redis_key(window), position)
+            bits = await pipe.execute()
+
+        return self.filter.presence(bits, len(windows))
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        self.windows.check_expire(expire)
+        if not items:
+            return
+
+        windows = self.windows.live()
+        if not self.client:
+            for key in items:
+                self._local.add(windows, self.filter.positions(key))
+            return
+
+        redis_key = self._redis_key(windows[-1])
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in items:
+                for position in self.filter.positions(key):
+                    pipe.setbit(redis_key, position, 1)
+            pipe.expire(redis_key, self.windows.window * self.windows.windows)
+            await pipe.execute()
+
+    def _redis_key(self, window: int) -> str:
+        return f"{self.key_prefix}:{window}"
+
 
 async def get_async_redis_cache(
     null_if_no_connection: bool = False, **kwargs: Any
@@ -0,0 +1,198 @@
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import funcy
+import redis
+
+
+class BloomFilter:
+    """
+    The layout of a Bloom filter sized for `capacity` keys with a false positive
+    rate of `error_rate`: how many bits it takes and which of them a key maps to
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+
+    def positions(self, key: str) -> List[int]:
+        # Double hashing: derives all the positions from a single digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def presence(self, bits: List[int], windows: int) -> List[bool]:
+        """
+        Tells whether each key is present in the filter of any window, out of the
+        bits of its positions laid out key after key and window after window
+        """
+        in_windows = funcy.chunks(
+            windows, map(all, funcy.chunks(self.hash_count, bits))
+        )
+        return [any(in_key_windows) for in_key_windows in in_windows]
+
+
+class RotatingWindows:
+    """
+    Splits the time in windows of `window` seconds, each with a filter of its own.
+    Keys are added to the filter of the current window and looked up in the
+    filters of the last `windows` windows, so a key is remembered for at least
+    `(windows - 1) * window` seconds, and the filters of older windows are dropped.
+    """
+
+    def __init__(self, window: int, windows: int) -> None:
+        self.window = window
+        self.windows = windows
+
+    def current(self) -> int:
+        return int(time.time() // self.window)
+
+    def live(self) -> List[int]:
+        current = self.current()
+        return list(range(current - self.windows + 1, current + 1))
+
+    @property
+    def retention(self) -> int:
+        """
+        For how many seconds a key is remembered, at least
+        """
+        return (self.windows - 1) * self.window
+
+    def check_expire(self, expire: Optional[int]) -> None:
+        """
+        Rejects an expiration that the windows cannot honour
+        """
+        if expire and expire > self.retention:
+            raise ValueError(
+                f"The keys are kept for {self.retention} seconds, less than the "
+                f"{expire} requested. Use more or longer windows."
+            )
+
+
+class LocalBitmaps:
+    """
+    Keeps the bits of the filter of every window in process memory
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._bitmaps: Dict[int, bytearray] = {}
+        self._lock = threading.Lock()
+
+    def test(self, windows: List[int], positions: List[int]) -> bool:
+        with self._lock:
+            for window in windows:
+                bitmap = self._bitmaps.get(window)
+                if bitmap is not None and all(
+                    bitmap[position >> 3] & (1 << (position & 7))
+                    for position in positions
+                ):
+                    return True
+            return False
+
+    def add(self, windows: List[int], positions: List[int]) -> None:
+        """
+        Sets the bits in the filter of the last of the `windows`,
+        forgetting the filters of the windows before the first one
+        """
+        with self._lock:
+            for window in list(self._bitmaps):
+                if window < windows[0]:
+                    del self._bitmaps[window]
+
+            bitmap = self._bitmaps.get(windows[-1])
+            if bitmap is None:
+                bitmap = self._bitmaps[windows[-1]] = bytearray(
+                    math.ceil(self.size / 8)
+                )
+            for position in positions:
+                bitmap[position >> 3] |= 1 << (position & 7)
+
+
+class BloomFilterCache:
+    """
+    A deduplication cache with bounded memory: instead of one key per message, it
+    keeps a Bloom filter per time window (see `RotatingWindows`), each sized for
+    `capacity` keys with a false positive rate of `error_rate`. A false positive
+    means that a message that was never processed is taken as a duplicate.
+
+    The filters live in process memory, unless a Redis `client` is supplied, in
+    which case they are kept as Redis bitmaps shared by all the processes and
+    expire along with their windows. Values are not kept, so `get` always
+    returns None.
+
+    How long the keys are kept depends only on the windows, not on the `expire`
+    of `store` (such as the `deduplication_window` of the dispatchers). An
+    `expire` longer than the windows can keep the keys raises a ValueError.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000000,
+        error_rate: float = 0.001,
+        window: int = 3600,
+        windows: int = 2,
+        client: Optional[redis.Redis] = None,
+        key_prefix: str = "melange:dedup",
+    ) -> None:
+        self.filter = BloomFilter(capacity, error_rate)
+        self.windows = RotatingWindows(window, windows)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._local = LocalBitmaps(self.filter.size)
+
+    def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.store_many({key: value}, expire)
+
+    def get(self, key: str) -> Any:
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_many([key])[0]
+
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        if not keys:
+            return []
+
+        windows = self.windows.live()
+        if not self.client:
+            return [
+                self._local.test(windows, self.filter.positions(key)) for key in keys
+            ]
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                for window in windows:
+                    for position in self.filter.positions(key):
+                        pipe.getbit(self._redis_key(window), position)
+            bits = pipe.execute()
+
+        return self.filter.presence(bits, len(windows))
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        self.windows.check_expire(expire)
+        if not items:
+            return
+
+        windows = self.windows.live()
+        if not self.client:
+            for key in items:
+                self._local.add(windows, self.filter.positions(key))
+            return
+
+        redis_key = self._redis_key(windows[-1])
+        with self.client.pipeline(transaction=False) as pipe:
+            for key in items:
+                for position in self.filter.positions(key):
+                    pipe.setbit(redis_key, position, 1)
+            pipe.expire(redis_key, self.windows.window * self.windows.windows)
+            pipe.execute()
+
+    def _redis_key(self, window: int) -> str:
+        return f"{self.key_prefix}:{window}"
@@ -1,10 +1,45 @@
 import logging
-from typing import Any, Optional, Protocol
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Dict, List, Optional, Protocol, Set, Tuple, cast
 
 import redis
 
 logger = logging.getLogger(__name__)
 
+# How long the deduplication keys are kept by default, in seconds. Matches the
+# default retention period of SQS, after which a message cannot be redelivered
+DEFAULT_DEDUPLICATION_WINDOW = 4 * 24 * 3600
+
+# The value of a claimed key until the claim is confirmed
+PROCESSING_MARKER = "__melange_processing__"
+
+# Claims a key in a single round trip, telling apart why it could not be claimed
+CLAIM_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 'claimed'
+end
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return 'in_progress'
+end
+return 'processed'
+"""
+
+
+class ClaimResult(Enum):
+    """
+    The outcome of claiming a deduplication key
+    """
+
+    # The key is ours: process the message, then confirm or release the claim
+    CLAIMED = "claimed"
+    # The message was already processed
+    PROCESSED = "processed"
+    # Someone else is processing the message right now
+    IN_PROGRESS = "in_progress"
+
 
 class DeduplicationCache(Protocol):
     def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
@@ -40,6 +75,58 @@ class DeduplicationCache(Protocol):
         """
         raise NotImplementedError
 
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        """
+        Checks whether each of the keys is present in the store, in one go
+
+        Args:
+            keys: the keys to check
+
+        Returns:
+            A list with the presence of each key, in the same order as `keys`
+        """
+        raise NotImplementedError
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        """
+        Stores several keys into the cache, in one go
+        Args:
+            items: the keys to store along with their values
+            expire: expiration time in seconds
+        """
+        raise NotImplementedError
+
+
+class ClaimingDeduplicationCache(DeduplicationCache, Protocol):
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        """
+        Atomically claims a key for processing, unless it is already present
+        Args:
+            key: the key to claim
+            ttl: seconds after which the claim is lost if not confirmed,
+                in case the processing never finishes
+
+        Returns:
+            Whether the key has been claimed, or otherwise why not
+        """
+        raise NotImplementedError
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        """
+        Stores the value of a claimed key, once the processing has succeeded
+        Args:
+            key:
+            value:
+            expire: expiration time in seconds
+        """
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        """
+        Gives up a claimed key, so that the message can be processed again
+        """
+        raise NotImplementedError
+
 
 class NullCache:
     """
@@ -55,8 +142,28 @@ class NullCache:
     def __contains__(self, key: str) -> bool:
         return False
 
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        return [False] * len(keys)
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        pass
+
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        return ClaimResult.CLAIMED
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        pass
+
+    def release(self, key: str) -> None:
+        pass
+
 
 class RedisCache:
+    """
+    A deduplication cache on Redis. Keys are stored for `expire` seconds
+    unless an expiration is given explicitly.
+    """
+
     def __init__(self, **kwargs: Any) -> None:
         self.client = redis.Redis(
             host=kwargs.get("host", 3600),
@@ -65,10 +172,11 @@ class RedisCache:
             password=kwargs.get("password", 3600),
             decode_responses=True,
         )
-        self.expire = kwargs.get("expire", 3600)
+        self.expire = kwargs.get("expire", DEFAULT_DEDUPLICATION_WINDOW)
+        self._claim = self.client.register_script(CLAIM_SCRIPT)
 
     def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        self.client.set(key, value, expire)
+        self.client.set(key, value, expire or self.expire)
 
     def get(self, key: str) -> Any:
         return self.client.get(key)
@@ -79,6 +187,222 @@ class RedisCache:
     def __contains__(self, key: str) -> bool:
         return self.contains(key)
 
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        if not keys:
+            return []
+        return [value is not None for value in self.client.mget(keys)]
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        if not items:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, expire or self.expire)
+            pipe.execute()
+
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        return ClaimResult(self._claim(keys=[key], args=[PROCESSING_MARKER, ttl]))
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.client.set(key, value, expire or self.expire)
+
+    def release(self, key: str) -> None:
+        self.client.delete(key)
+
+    def count_keys(self, pattern: str = "*") -> int:
+        """
+        Counts the live keys matching the pattern, e.g. `"myapp.consumers.*"`
+        for the deduplication keys of the consumers of a module. Counting all
+        the keys is cheap, any other pattern scans the whole keyspace.
+        """
+        if pattern == "*":
+            return self.client.dbsize()
+        return sum(1 for _ in self.client.scan_iter(match=pattern, count=1000))
+
+
+class DeduplicationBatch:
+    """
+    A view over a `DeduplicationCache` for a batch of messages. Call `load` to check
+    the presence of all the keys of the batch with one `contains_many` call.
+    The keys stored through this view are buffered until `flush` writes them
+    back with a single `store_many` call.
+
+    Claims, confirmations and releases go straight to the underlying cache, which
+    must then be a `ClaimingDeduplicationCache`: only the cache can tell a key
+    being processed by another worker from a processed one.
+    """
+
+    def __init__(self, cache: DeduplicationCache) -> None:
+        self._cache = cache
+        self._present: Set[str] = set()
+        self._pending: Dict[str, Any] = {}
+        self._expire: Optional[int] = None
+
+    def load(self, keys: List[str]) -> None:
+        self._present = {
+            key
+            for key, present in zip(keys, self._cache.contains_many(keys))
+            if present
+        }
+
+    def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self._pending[key] = value
+        self._expire = expire
+
+    def get(self, key: str) -> Any:
+        if key in self._pending:
+            return self._pending[key]
+        return self._cache.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._present or key in self._pending
+
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        return [key in self for key in keys]
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        for key, value in items.items():
+            self.store(key, value, expire)
+
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        return cast(ClaimingDeduplicationCache, self._cache).claim(key, ttl)
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        cast(ClaimingDeduplicationCache, self._cache).confirm(key, value, expire)
+
+    def release(self, key: str) -> None:
+        cast(ClaimingDeduplicationCache, self._cache).release(key)
+
+    def flush(self) -> None:
+        """
+        Writes the buffered keys back to the underlying cache
+        """
+        pending, self._pending = self._pending, {}
+        self._cache.store_many(pending, self._expire)
+
+
+# Stands for a key known to be present whose value has not been fetched
+_PRESENT = object()
+
+
+class LocalCache:
+    """
+    A bounded in-process map of the keys known to be present in a cache. Keys are
+    forgotten `ttl` seconds after being put, and the least recently used keys are
+    evicted once there are more than `max_size`.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return self._lookup(key) is not None
+
+    def get(self, key: str) -> Any:
+        """
+        Returns the value of the key, or None if the key is missing
+        or its value is unknown
+        """
+        entry = self._lookup(key)
+        return None if entry is None or entry[1] is _PRESENT else entry[1]
+
+    def put(
+        self, key: str, value: Any = _PRESENT, expire: Optional[int] = None
+    ) -> None:
+        ttl = min(self.ttl, expire) if expire else self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _lookup(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+
+class TieredDeduplicationCache:
+    """
+    Puts a `LocalCache` in front of another cache, usually a `RedisCache`. The keys
+    known to be present are answered locally, so that a duplicate arriving shortly
+    after the original at the same process does not hit the underlying cache.
+    Absent keys are always checked against the underlying cache, and all the writes
+    go through to it.
+    """
+
+    def __init__(
+        self, cache: DeduplicationCache, max_size: int = 10000, ttl: float = 60
+    ) -> None:
+        self._cache = cache
+        self.local = LocalCache(max_size, ttl)
+
+    def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self._cache.store(key, value, expire)
+        self.local.put(key, value, expire)
+
+    def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is None:
+            value = self._cache.get(key)
+            if value is not None:
+                self.local.put(key, value)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.local:
+            return True
+        if key in self._cache:
+            self.local.put(key)
+            return True
+        return False
+
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        presence = {key: True for key in keys if key in self.local}
+        missing = [key for key in keys if key not in presence]
+        for key, present in zip(missing, self._cache.contains_many(missing)):
+            presence[key] = present
+            if present:
+                self.local.put(key)
+        return [presence[key] for key in keys]
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        self._cache.store_many(items, expire)
+        for key, value in items.items():
+            self.local.put(key, value, expire)
+
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        if key in self.local:
+            return ClaimResult.PROCESSED
+        return cast(ClaimingDeduplicationCache, self._cache).claim(key, ttl)
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        cast(ClaimingDeduplicationCache, self._cache).confirm(key, value, expire)
+        self.local.put(key, value, expire)
+
+    def release(self, key: str) -> None:
+        self.local.discard(key)
+        cast(ClaimingDeduplicationCache, self._cache).release(key)
+
+    def count_keys(self, pattern: str = "*") -> int:
+        """
+        Counts the live keys of the underlying cache (see `RedisCache.count_keys`)
+        """
+        return cast(RedisCache, self._cache).count_keys(pattern)
+
 
 def get_redis_cache(
     null_if_no_connection: bool = False, **kwargs: Any
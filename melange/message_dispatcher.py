@@ -1,22 +1,70 @@
 import asyncio
 import logging
-from typing import Any, Callable, List, Optional, Union
+import math
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, contextmanager, nullcontext
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from anyio import (
     CancelScope,
     CapacityLimiter,
+    Semaphore,
     create_memory_object_stream,
     create_task_group,
+    to_thread,
 )
 from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+from funcy import group_by
 
+from melange.backends.acknowledgement import (
+    AcknowledgementBuffer,
+    AsyncAcknowledgementBuffer,
+)
 from melange.backends.backend_manager import BackendManager
+from melange.backends.heartbeat import (
+    AsyncBufferWatchdog,
+    AsyncVisibilityHeartbeat,
+    VisibilityHeartbeat,
+)
 from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
 from melange.consumers import AsyncConsumer, Consumer
 from melange.exceptions import SerializationError
-from melange.infrastructure.async_cache import AsyncDeduplicationCache, AsyncNullCache
-from melange.infrastructure.cache import DeduplicationCache, NullCache
+from melange.infrastructure.async_cache import (
+    AsyncClaimingDeduplicationCache,
+    AsyncDeduplicationBatch,
+    AsyncDeduplicationCache,
+    AsyncNullCache,
+)
+from melange.infrastructure.cache import (
+    ClaimingDeduplicationCache,
+    ClaimResult,
+    DeduplicationBatch,
+    DeduplicationCache,
+    NullCache,
+)
 from melange.models import Message, QueueWrapper
+from melange.pollers import PollerScaler
+from melange.prefetcher import MessagePrefetcher
 from melange.serializers.registry import SerializerRegistry
 from melange.utils import get_fully_qualified_name
 
@@ -24,6 +72,8 @@ from melange.utils import get_fully_qualified_name
 
 logger = logging.getLogger(__name__)
 
+C = TypeVar("C", Consumer, AsyncConsumer)
+
 
 class MessageDispatcher:
     """
@@ -39,6 +89,16 @@ class MessageDispatcher:
         backend: Optional[MessagingBackend] = None,
         always_ack: bool = False,
         early_ack: bool = False,
+        max_workers: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        batch_deduplication: bool = False,
+        buffer_acks: bool = False,
+        ack_linger: float = 0.2,
+        prefetch: int = 0,
+        visibility_heartbeat: bool = False,
+        fan_out: bool = False,
+        claim_ttl: Optional[int] = None,
+        deduplication_window: Optional[int] = None,
     ) -> None:
         """
 
@@ -50,13 +110,81 @@ class MessageDispatcher:
             early_ack: Whether the incoming message should be acknowledged immediately
             upon receiving. Overrides `always_ack`. Useful when the message
             processing is long and you need to skip the visibility timeout of SQS
+            max_workers: If set, the messages are dispatched concurrently on a pool
+            of this many threads, with no more than `max_workers` messages in flight
+            at any time. Each message is acknowledged as soon as it completes.
+            Note that `on_exception` and `after_consume` will then be invoked
+            from the worker threads.
+            max_processes: If set, `consumer.process` is run on a pool of this many
+            processes, for CPU-bound consumers. The processes are spawned rather
+            than forked, so the consumers must be importable, and they and the
+            deserialized messages must be picklable. Deduplication and
+            acknowledgement still happen in this process. Unless `max_workers` is
+            set, up to `max_processes` messages will be in flight.
+            batch_deduplication: Whether to dispatch the messages in the batches
+            they are received in, checking the deduplication keys of a whole batch
+            with one `contains_many` call and storing them with one `store_many`
+            call. The messages of a batch are acknowledged once the whole batch has
+            been processed, and `after_consume` is called once per batch.
+            buffer_acks: Whether to buffer the acknowledgements and send them with
+            `acknowledge_batch` once 10 of them are pending, or once the oldest one
+            has waited for `ack_linger` seconds. Pending acknowledgements are
+            always sent before `consume_event` returns.
+            ack_linger: The maximum number of seconds an acknowledgement is buffered
+            prefetch: If set, a background thread keeps receiving messages (or
+            batches, with `batch_deduplication`) ahead of the dispatching, buffering
+            up to this many of them. The receiver holds off while the buffered
+            messages would not be dispatched within the `visibility_timeout`
+            of the backend, and those that outlive it in the buffer are skipped.
+            With `visibility_heartbeat`, half of the `visibility_timeout` is left
+            for the first heartbeat to extend the messages once dispatched.
+            visibility_heartbeat: Whether to keep extending the visibility timeout
+            of the messages while they are being processed, every half of the
+            `visibility_timeout` of the backend. This allows a short visibility
+            timeout, so that messages are redelivered soon after a crash, without
+            long-running messages being delivered twice. Ignored with `early_ack`.
+            fan_out: Whether to pass a message to all the consumers interested in it
+            concurrently, on a thread pool, rather than one after the other.
+            claim_ttl: If set, the deduplication key of each consumer is claimed
+            before processing the message, with a single atomic call, and confirmed
+            or released afterwards. A message being processed by another worker is
+            then neither processed nor acknowledged. The claim is lost after
+            `claim_ttl` seconds if never confirmed. The cache must implement
+            `ClaimingDeduplicationCache`.
+            deduplication_window: For how many seconds the deduplication keys are
+            kept. Defaults to the expiration of the cache, which for the Redis
+            caches is the default retention period of SQS. The Bloom filter
+            caches keep the keys as long as their windows do and reject a longer
+            window.
         """
         self._consumers: List[Consumer] = []
+        self._routes: Dict[Type, List[Consumer]] = {}
         self.serializer_registry = serializer_registry
         self._backend = backend or BackendManager().get_default_backend()
         self.cache: DeduplicationCache = cache or NullCache()
         self.always_ack = always_ack
         self.early_ack = early_ack
+        self.max_workers = max_workers or max_processes
+        self.max_processes = max_processes
+        self.batch_deduplication = batch_deduplication
+        self.prefetch = prefetch
+        self._heartbeat: Optional[VisibilityHeartbeat] = (
+            VisibilityHeartbeat(self._backend, _get_visibility_timeout(self._backend))
+            if visibility_heartbeat and not early_ack
+            else None
+        )
+        self._ack_buffer: Optional[AcknowledgementBuffer] = (
+            AcknowledgementBuffer(self._backend, linger=ack_linger)
+            if buffer_acks
+            else None
+        )
+        self.fan_out = fan_out
+        self.claim_ttl = claim_ttl
+        if claim_ttl:
+            _check_claiming_cache(self.cache)
+        self.deduplication_window = deduplication_window
+        self._process_executor: Optional[ProcessPoolExecutor] = None
+        self._fan_out_executor: Optional[ThreadPoolExecutor] = None
 
     def attach_consumer(self, consumer: Consumer) -> None:
         """
@@ -66,6 +194,7 @@ class MessageDispatcher:
         """
         if consumer not in self._consumers:
             self._consumers.append(consumer)
+            self._routes.clear()
 
     def unattach_consumer(self, consumer: Consumer) -> None:
         """
@@ -75,6 +204,7 @@ class MessageDispatcher:
         """
         if consumer in self._consumers:
             self._consumers.remove(consumer)
+            self._routes.clear()
 
     def consume_loop(
         self,
@@ -104,70 +234,377 @@ class MessageDispatcher:
         """
         event_queue = self._backend.get_queue(queue_name)
 
-        messages = self._backend.yield_messages(event_queue)
-        for message in messages:
+        try:
+            with self._heartbeat or nullcontext(), self._fan_out_pool():
+                self._consume(event_queue, on_exception, after_consume)
+        finally:
+            if self._ack_buffer:
+                self._ack_buffer.flush()
+
+    @contextmanager
+    def _fan_out_pool(self) -> Iterator[None]:
+        if not self.fan_out:
+            yield
+            return
+
+        with ThreadPoolExecutor(thread_name_prefix="melange-fan-out") as executor:
+            self._fan_out_executor = executor
             try:
-                if self.early_ack:
-                    self._backend.acknowledge(message)
+                yield
+            finally:
+                self._fan_out_executor = None
+
+    def _consume(
+        self,
+        event_queue: QueueWrapper,
+        on_exception: Optional[Callable[[Exception], None]] = None,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        items: Iterable[Any] = (
+            filter(None, self._backend.yield_batches(event_queue))
+            if self.batch_deduplication
+            else self._backend.yield_messages(event_queue)
+        )
+        consume: Callable[..., None] = (
+            self._consume_batch if self.batch_deduplication else self._consume_message
+        )
+
+        if self.prefetch:
+            items = MessagePrefetcher(
+                items,
+                self.prefetch,
+                max_age=self._get_prefetch_max_age(),
+            )
+
+        if self.max_processes:
+            # A forked process could inherit locks held by the threads of this one
+            with ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                self._process_executor = executor
+                try:
+                    self._consume_concurrently(
+                        items, consume, on_exception, after_consume
+                    )
+                finally:
+                    self._process_executor = None
+            return
+
+        if self.max_workers:
+            self._consume_concurrently(items, consume, on_exception, after_consume)
+            return
+
+        for item in items:
+            consume(item, on_exception, after_consume)
+
+    def _consume_concurrently(
+        self,
+        items: Iterable[Any],
+        consume: Callable[..., None],
+        on_exception: Optional[Callable[[Exception], None]] = None,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Dispatches the messages (or batches) on a thread pool. The semaphore
+        provides the backpressure: nothing else is pulled from the backend until
+        one of the in-flight items is done.
+        """
+        assert self.max_workers
+        in_flight = threading.BoundedSemaphore(self.max_workers)
 
+        def _release(_: Future) -> None:
+            in_flight.release()
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="melange-dispatcher"
+        ) as executor:
+            for item in items:
+                in_flight.acquire()
+                future = executor.submit(consume, item, on_exception, after_consume)
+                future.add_done_callback(_release)
+
+    def _consume_message(
+        self,
+        message: Message,
+        on_exception: Optional[Callable[[Exception], None]] = None,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        try:
+            if self.early_ack:
+                self._acknowledge(message)
+
+            with self._track([message]):
                 self._dispatch_message(message)
-            except Exception as e:
-                logger.exception(e)
-                if on_exception:
-                    on_exception(e)
-            finally:
-                if after_consume:
-                    after_consume()
+        except Exception as e:
+            logger.exception(e)
+            if on_exception:
+                on_exception(e)
+        finally:
+            if after_consume:
+                after_consume()
+
+    def _consume_batch(
+        self,
+        messages: List[Message],
+        on_exception: Optional[Callable[[Exception], None]] = None,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        try:
+            if self.early_ack:
+                for message in messages:
+                    self._acknowledge(message)
+
+            with self._track(messages):
+                self._dispatch_batch(messages)
+        except Exception as e:
+            logger.exception(e)
+            if on_exception:
+                on_exception(e)
+        finally:
+            if after_consume:
+                after_consume()
 
     def _get_consumers(self, message_data: Any) -> List[Consumer]:
-        return [
-            consumer for consumer in self._consumers if consumer.accepts(message_data)
-        ]
+        return _route(self._routes, self._consumers, message_data)
 
     def _dispatch_message(self, message: Message) -> None:
-        manifest = message.get_message_manifest()
-
         # If the message cannot be deserialized, just ignore it.
         # ACK it anyway to avoid hanging on the same message over an over again
         try:
-            if message.serializer_id is not None:
-                message_data = self.serializer_registry.deserialize_with_serializerid(
-                    message.content, message.serializer_id, manifest=manifest
-                )
-            else:
-                # TODO: If no serializerid is supplied, at least we need to grab some
-                # clue in the message to know which serializer must be used.
-                # for now, rely on the default.
-                message_data = self.serializer_registry.deserialize_with_class(
-                    message.content, object, manifest=manifest
-                )
+            message_data = _deserialize(self.serializer_registry, message)
         except SerializationError as e:
             logger.error(e)
-            self._backend.acknowledge(message)
+            self._acknowledge(message)
             return
 
         consumers = self._get_consumers(message_data)
 
-        successful = 0
-        for consumer in consumers:
+        if self._deliver(message, message_data, consumers, self.cache):
+            self._acknowledge(message)
+
+    def _dispatch_batch(self, messages: List[Message]) -> None:
+        """
+        Dispatches a batch of messages checking all the deduplication keys of
+        the batch at once, and storing them back at once before acknowledging
+        """
+        deliveries = []
+        for message in messages:
             try:
-                # Store into the cache
-                message_key = (
-                    f"{get_fully_qualified_name(consumer)}.{message.message_id}"
+                message_data = _deserialize(self.serializer_registry, message)
+            except SerializationError as e:
+                logger.error(e)
+                self._acknowledge(message)
+                continue
+
+            deliveries.append(
+                (message, message_data, self._get_consumers(message_data))
+            )
+
+        cache = DeduplicationBatch(self.cache)
+        # Claims go straight to the cache, so there is nothing to load for them
+        if not self.claim_ttl:
+            cache.load(
+                [
+                    _get_message_key(consumer, message)
+                    for message, _, consumers in deliveries
+                    for consumer in consumers
+                ]
+            )
+
+        messages_to_ack = [
+            message
+            for message, message_data, consumers in deliveries
+            if self._deliver(message, message_data, consumers, cache)
+        ]
+
+        cache.flush()
+        for message in messages_to_ack:
+            self._acknowledge(message)
+
+    def _deliver(
+        self,
+        message: Message,
+        message_data: Any,
+        consumers: List[Consumer],
+        cache: DeduplicationCache,
+    ) -> bool:
+        """
+        Passes the message to the consumers, skipping those that already processed it.
+
+        Returns:
+            Whether the message must be acknowledged
+        """
+        executor = self._fan_out_executor
+        if executor and len(consumers) > 1:
+            futures = [
+                executor.submit(
+                    self._deliver_to, consumer, message, message_data, cache
                 )
+                for consumer in consumers
+            ]
+            successful = sum(future.result() for future in futures)
+        else:
+            successful = sum(
+                self._deliver_to(consumer, message, message_data, cache)
+                for consumer in consumers
+            )
 
-                if message_key in self.cache:
-                    logger.info("detected a duplicated message, ignoring")
-                else:
-                    consumer.process(message_data, message_id=message.message_id)
-                    successful += 1
-                    self.cache.store(message_key, message_key)
-            except Exception as e:
-                logger.exception(e)
+        return not self.early_ack and (self.always_ack or successful == len(consumers))
+
+    def _deliver_to(
+        self,
+        consumer: Consumer,
+        message: Message,
+        message_data: Any,
+        cache: DeduplicationCache,
+    ) -> bool:
+        """
+        Returns whether the consumer processed the message, now or in the past
+        """
+        try:
+            # Store into the cache
+            message_key = _get_message_key(consumer, message)
 
-        if not self.early_ack and (self.always_ack or successful == len(consumers)):
+            if self.claim_ttl:
+                return self._deliver_claimed(
+                    consumer,
+                    message,
+                    message_data,
+                    cast(ClaimingDeduplicationCache, cache),
+                    message_key,
+                )
+
+            if message_key in cache:
+                logger.info("detected a duplicated message, ignoring")
+            else:
+                self._process(consumer, message_data, message)
+                cache.store(message_key, message_key, self.deduplication_window)
+            return True
+        except Exception as e:
+            logger.exception(e)
+            return False
+
+    def _deliver_claimed(
+        self,
+        consumer: Consumer,
+        message: Message,
+        message_data: Any,
+        cache: ClaimingDeduplicationCache,
+        message_key: str,
+    ) -> bool:
+        assert self.claim_ttl
+        claim = cache.claim(message_key, self.claim_ttl)
+        if claim == ClaimResult.PROCESSED:
+            logger.info("detected a duplicated message, ignoring")
+            return True
+        if claim == ClaimResult.IN_PROGRESS:
+            logger.info("the message is being processed somewhere else, skipping")
+            return False
+
+        try:
+            self._process(consumer, message_data, message)
+        except Exception:
+            cache.release(message_key)
+            raise
+        cache.confirm(message_key, message_key, self.deduplication_window)
+        return True
+
+    def _get_prefetch_max_age(self) -> Optional[float]:
+        visibility_timeout = getattr(self._backend, "visibility_timeout", None)
+        if visibility_timeout and self._heartbeat:
+            # The first beat may come up to an interval after a message is dispatched
+            return visibility_timeout - self._heartbeat.interval
+        return visibility_timeout
+
+    def _track(self, messages: List[Message]) -> ContextManager[None]:
+        return self._heartbeat.track(messages) if self._heartbeat else nullcontext()
+
+    def _acknowledge(self, message: Message) -> None:
+        if self._ack_buffer:
+            self._ack_buffer.add(message)
+        else:
             self._backend.acknowledge(message)
 
+    def _process(self, consumer: Consumer, message_data: Any, message: Message) -> None:
+        if self._process_executor:
+            self._process_executor.submit(
+                _process_in_worker, consumer, message_data, message.message_id
+            ).result()
+        else:
+            consumer.process(message_data, message_id=message.message_id)
+
+
+def _deserialize(serializer_registry: SerializerRegistry, message: Message) -> Any:
+    manifest = message.get_message_manifest()
+    if message.serializer_id is not None:
+        return serializer_registry.deserialize_with_serializerid(
+            message.content, message.serializer_id, manifest=manifest
+        )
+
+    # TODO: If no serializerid is supplied, at least we need to grab some
+    # clue in the message to know which serializer must be used.
+    # for now, rely on the default.
+    return serializer_registry.deserialize_with_class(
+        message.content, object, manifest=manifest
+    )
+
+
+def _route(
+    routes: Dict[Type, List[C]], consumers: List[C], message_data: Any
+) -> List[C]:
+    """
+    Returns the consumers that accept the message. The consumers that accept by
+    type are only asked once per message type, and the answer is kept in `routes`.
+    """
+    message_type = type(message_data)
+    route = routes.get(message_type)
+    if route is None:
+        route = [
+            consumer
+            for consumer in consumers
+            if not consumer.accepts_by_type or consumer.accepts(message_data)
+        ]
+        routes[message_type] = route
+
+    return [
+        consumer
+        for consumer in route
+        if consumer.accepts_by_type or consumer.accepts(message_data)
+    ]
+
+
+def _get_visibility_timeout(
+    backend: Union[MessagingBackend, AsyncMessagingBackend],
+) -> int:
+    visibility_timeout = getattr(backend, "visibility_timeout", None)
+    if not visibility_timeout:
+        raise Exception(
+            "The visibility heartbeat requires a backend with a visibility timeout"
+        )
+    return visibility_timeout
+
+
+def _check_claiming_cache(cache: Any) -> None:
+    if not all(hasattr(cache, method) for method in ("claim", "confirm", "release")):
+        raise Exception(
+            "claim_ttl requires a cache that can claim keys, "
+            f"which {type(cache).__name__} cannot"
+        )
+
+
+def _get_message_key(consumer: Union[Consumer, AsyncConsumer], message: Message) -> str:
+    return f"{get_fully_qualified_name(consumer)}.{message.message_id}"
+
+
+def _process_in_worker(
+    consumer: Consumer, message_data: Any, message_id: Optional[str]
+) -> None:
+    """
+    Entrypoint of the process pool. Lives at module level so that it can be pickled
+    """
+    consumer.process(message_data, message_id=message_id)
+
 
 class AsyncMessageDispatcher:
     """
@@ -183,6 +620,19 @@ class AsyncMessageDispatcher:
         cache: Optional[AsyncDeduplicationCache] = None,
         always_ack: bool = False,
         early_ack: bool = False,
+        batch_deduplication: bool = False,
+        visibility_heartbeat: bool = False,
+        buffer_acks: bool = False,
+        ack_linger: float = 0.2,
+        pollers: int = 1,
+        buffer_size: Optional[int] = None,
+        extend_buffered: bool = False,
+        release_buffered: bool = False,
+        thread_limiter: Optional[CapacityLimiter] = None,
+        fan_out: bool = False,
+        claim_ttl: Optional[int] = None,
+        deduplication_window: Optional[int] = None,
+        offload_deserialization: Optional[int] = None,
     ) -> None:
         """
 
@@ -194,13 +644,95 @@ class AsyncMessageDispatcher:
             early_ack: Whether the incoming message should be acknowledged immediately
             upon receiving. Overrides `always_ack`. Useful when the message
             processing is long and you need to skip the visibility timeout of SQS
+            batch_deduplication: Whether to dispatch the messages in the batches
+            they are received in, checking the deduplication keys of a whole batch
+            with one `contains_many` call and storing them with one `store_many`
+            call. The messages of a batch are acknowledged once the whole batch has
+            been processed, and `after_consume` is called once per batch.
+            visibility_heartbeat: Whether to keep extending the visibility timeout
+            of the messages while they are being processed, every half of the
+            `visibility_timeout` of the backend. This allows a short visibility
+            timeout, so that messages are redelivered soon after a crash, without
+            long-running messages being delivered twice. Ignored with `early_ack`.
+            buffer_acks: Whether to coalesce the acknowledgements of the concurrent
+            dispatches and send them with `acknowledge_batch` once 10 of them are
+            pending, or once the oldest one has waited for `ack_linger` seconds.
+            Pending acknowledgements are always sent before the consumption ends.
+            ack_linger: The maximum number of seconds an acknowledgement is buffered
+            pollers: The maximum number of concurrent receives of `consume_loop`.
+            A new poller is started whenever a receive comes back full, and one is
+            stopped whenever a receive comes back empty, down to a single poller.
+            buffer_size: The maximum number of received messages (or batches, with
+            `batch_deduplication`) waiting to be dispatched. Defaults to the total
+            tokens of the `message_processing_limit`. Once it is full, the
+            receivers wait for the dispatches to catch up.
+            extend_buffered: Whether to extend the visibility timeout of the messages
+            that have been waiting to be dispatched for half of the
+            `visibility_timeout` of the backend, so that they are not redelivered
+            while still waiting locally.
+            release_buffered: Whether to release those messages instead, setting
+            their visibility timeout to 0 so that they are delivered again to any
+            consumer right away, and skipping them locally. Overrides
+            `extend_buffered`.
+            thread_limiter: Limits how many synchronous consumers run at once.
+            Synchronous consumers run in worker threads so that they do not block
+            the event loop. Defaults to a limiter of this dispatcher with 40
+            tokens, as many as the default thread limiter of anyio.
+            fan_out: Whether to pass a message to all the consumers interested in it
+            concurrently, rather than one after the other.
+            claim_ttl: If set, the deduplication key of each consumer is claimed
+            before processing the message, with a single atomic call, and confirmed
+            or released afterwards. A message being processed by another worker is
+            then neither processed nor acknowledged. The claim is lost after
+            `claim_ttl` seconds if never confirmed. The cache must implement
+            `AsyncClaimingDeduplicationCache`.
+            deduplication_window: For how many seconds the deduplication keys are
+            kept. Defaults to the expiration of the cache, which for the Redis
+            caches is the default retention period of SQS. The Bloom filter
+            caches keep the keys as long as their windows do and reject a longer
+            window.
+            offload_deserialization: If set, the messages whose content is longer
+            than this many characters are deserialized in a worker thread (limited
+            by `thread_limiter`), so that large payloads do not block the event loop.
         """
         self._consumers: List[AsyncConsumer] = []
+        self._routes: Dict[Type, List[AsyncConsumer]] = {}
         self.serializer_registry = serializer_registry
         self._backend = backend
         self.cache: AsyncDeduplicationCache = cache or AsyncNullCache()
         self.always_ack = always_ack
         self.early_ack = early_ack
+        self.batch_deduplication = batch_deduplication
+        self._heartbeat: Optional[AsyncVisibilityHeartbeat] = (
+            AsyncVisibilityHeartbeat(
+                self._backend, _get_visibility_timeout(self._backend)
+            )
+            if visibility_heartbeat and not early_ack
+            else None
+        )
+        self._ack_buffer: Optional[AsyncAcknowledgementBuffer] = (
+            AsyncAcknowledgementBuffer(self._backend, linger=ack_linger)
+            if buffer_acks
+            else None
+        )
+        self.pollers = pollers
+        self.buffer_size = buffer_size
+        self.thread_limiter = thread_limiter
+        self.fan_out = fan_out
+        self.claim_ttl = claim_ttl
+        if claim_ttl:
+            _check_claiming_cache(self.cache)
+        self.deduplication_window = deduplication_window
+        self.offload_deserialization = offload_deserialization
+        self._watchdog: Optional[AsyncBufferWatchdog] = (
+            AsyncBufferWatchdog(
+                self._backend,
+                _get_visibility_timeout(self._backend),
+                release=release_buffered,
+            )
+            if extend_buffered or release_buffered
+            else None
+        )
 
     def attach_consumer(self, consumer: AsyncConsumer) -> None:
         """
@@ -210,6 +742,7 @@ class AsyncMessageDispatcher:
         """
         if consumer not in self._consumers:
             self._consumers.append(consumer)
+            self._routes.clear()
 
     def unattach_consumer(self, consumer: AsyncConsumer) -> None:
         """
@@ -219,6 +752,7 @@ class AsyncMessageDispatcher:
         """
         if consumer in self._consumers:
             self._consumers.remove(consumer)
+            self._routes.clear()
 
     async def consume_event(
         self,
@@ -227,6 +761,7 @@ class AsyncMessageDispatcher:
         preserve_order: bool = False,
         on_exception: Optional[Callable[[Exception], None]] = None,
         after_consume: Optional[Callable[[], None]] = None,
+        preserve_group_order: bool = False,
     ) -> None:
         """
         Starts the consumption loop on the queue `queue_name`
@@ -236,27 +771,20 @@ class AsyncMessageDispatcher:
                 will be passed to this callback
             after_consume: After consuming a batch of events,
                 invoke this callback
+            preserve_group_order: Process the events of the same message group
+                (e.g. the `MessageGroupId` of a FIFO queue) in order, while
+                processing different groups concurrently. Ignored with
+                `preserve_order`
         """
         queue = await self._backend.get_queue(queue_name)
-
-        send_stream, receive_stream = create_memory_object_stream(max_buffer_size=20)
-        message_processing_limit = message_processing_limit or CapacityLimiter(1)
-        async with create_task_group() as tg:
-            tg.start_soon(self.receive_and_conume, send_stream, queue)
-            if preserve_order:
-                tg.start_soon(
-                    self.start_ordered_message_consumer,
-                    receive_stream,
-                    message_processing_limit,
-                    after_consume,
-                )
-            else:
-                tg.start_soon(
-                    self.start_unordered_message_consumer,
-                    receive_stream,
-                    message_processing_limit,
-                    after_consume,
-                )
+        await self._consume(
+            self.receive_and_conume,
+            queue,
+            message_processing_limit,
+            preserve_order,
+            after_consume,
+            preserve_group_order,
+        )
 
     async def consume_loop(
         self,
@@ -265,51 +793,147 @@ class AsyncMessageDispatcher:
         preserve_order: bool = False,
         on_exception: Optional[Callable[[Exception], None]] = None,
         after_consume: Optional[Callable[[], None]] = None,
+        preserve_group_order: bool = False,
     ) -> None:
         """
         Consumes events on the queue `queue_name`
         """
         queue = await self._backend.get_queue(queue_name)
+        await self._consume(
+            self.start_message_producer,
+            queue,
+            message_processing_limit,
+            preserve_order,
+            after_consume,
+            preserve_group_order,
+        )
 
-        send_stream, receive_stream = create_memory_object_stream(max_buffer_size=20)
+    async def _consume(
+        self,
+        producer: Callable[[MemoryObjectSendStream, QueueWrapper], Awaitable[None]],
+        queue: QueueWrapper,
+        message_processing_limit: Optional[CapacityLimiter] = None,
+        preserve_order: bool = False,
+        after_consume: Optional[Callable[[], None]] = None,
+        preserve_group_order: bool = False,
+    ) -> None:
         message_processing_limit = message_processing_limit or CapacityLimiter(1)
-        async with create_task_group() as tg:
-            tg.start_soon(self.start_message_producer, send_stream, queue)
-            if preserve_order:
-                tg.start_soon(
-                    self.start_ordered_message_consumer,
-                    receive_stream,
-                    message_processing_limit,
-                    after_consume,
-                )
-            else:
-                tg.start_soon(
-                    self.start_unordered_message_consumer,
-                    receive_stream,
-                    message_processing_limit,
-                    after_consume,
-                )
+        send_stream, receive_stream = create_memory_object_stream(
+            max_buffer_size=self._get_buffer_size(message_processing_limit)
+        )
+        async with AsyncExitStack() as stack:
+            if self._watchdog:
+                await stack.enter_async_context(self._watchdog)
+            if self._ack_buffer:
+                await stack.enter_async_context(self._ack_buffer)
+            if self._heartbeat:
+                await stack.enter_async_context(self._heartbeat)
+
+            async with create_task_group() as tg:
+                tg.start_soon(producer, send_stream, queue)
+                if preserve_order:
+                    tg.start_soon(
+                        self.start_ordered_message_consumer,
+                        receive_stream,
+                        message_processing_limit,
+                        after_consume,
+                    )
+                elif preserve_group_order:
+                    tg.start_soon(
+                        self.start_grouped_message_consumer,
+                        receive_stream,
+                        message_processing_limit,
+                        after_consume,
+                    )
+                else:
+                    tg.start_soon(
+                        self.start_unordered_message_consumer,
+                        receive_stream,
+                        message_processing_limit,
+                        after_consume,
+                    )
+
+    def _get_buffer_size(self, limiter: CapacityLimiter) -> int:
+        if self.buffer_size:
+            return self.buffer_size
+        return self._get_capacity(limiter)
+
+    def _get_capacity(self, limiter: CapacityLimiter) -> int:
+        if limiter.total_tokens == math.inf:
+            return 20
+        return max(1, int(limiter.total_tokens))
 
     async def receive_and_conume(
         self, send_stream: MemoryObjectSendStream, queue: QueueWrapper
     ) -> None:
         async with send_stream:
-            messages = self._backend.retrieve_messages(queue)
-            async for message in messages:
-                if self.early_ack:
-                    await self._backend.acknowledge(message)
-                await send_stream.send(message)
+            await self._receive(send_stream, queue)
 
     async def start_message_producer(
         self, send_stream: MemoryObjectSendStream, queue: QueueWrapper
     ) -> None:
         async with send_stream:
-            while True:
-                messages = self._backend.retrieve_messages(queue)
-                async for message in messages:
-                    if self.early_ack:
-                        await self._backend.acknowledge(message)
-                    await send_stream.send(message)
+            if self.pollers <= 1:
+                while True:
+                    await self._receive(send_stream, queue)
+
+            scaler = PollerScaler(
+                self.pollers,
+                getattr(self._backend, "max_number_of_messages", 10),
+            )
+            async with create_task_group() as tg:
+                for index in range(self.pollers):
+                    tg.start_soon(self._poll, send_stream, queue, scaler, index)
+
+    async def _poll(
+        self,
+        send_stream: MemoryObjectSendStream,
+        queue: QueueWrapper,
+        scaler: PollerScaler,
+        index: int,
+    ) -> None:
+        while True:
+            await scaler.wait_until_active(index)
+            scaler.record(await self._receive(send_stream, queue))
+
+    async def _receive(
+        self, send_stream: MemoryObjectSendStream, queue: QueueWrapper
+    ) -> int:
+        """
+        Retrieves a batch of messages and sends them down the stream, either
+        one by one or as a whole batch if `batch_deduplication` is enabled.
+        Returns the number of messages received
+        """
+        messages = self._backend.retrieve_messages(queue)
+        if self.batch_deduplication:
+            batch = [message async for message in messages]
+            if self.early_ack:
+                for message in batch:
+                    await self._acknowledge(message)
+            if batch:
+                self._buffer(batch, batch)
+                await send_stream.send(batch)
+            return len(batch)
+
+        received = 0
+        async for message in messages:
+            if self.early_ack:
+                await self._acknowledge(message)
+            self._buffer(message, [message])
+            await send_stream.send(message)
+            received += 1
+        return received
+
+    def _buffer(self, item: Any, messages: List[Message]) -> None:
+        if self._watchdog:
+            self._watchdog.buffer(item, messages)
+
+    def _unbuffer(self, item: Any) -> bool:
+        """
+        Stops watching a received item once it is about to be dispatched.
+        Returns whether it is still to be dispatched
+        """
+        return self._watchdog.take(item) if self._watchdog else True
 
     async def wrap(
         self, after_consume: Optional[Callable[[], None]], f: Callable, *args: Any
@@ -326,16 +950,39 @@ class AsyncMessageDispatcher:
         message_processing_limit: CapacityLimiter,
         after_consume: Optional[Callable[[], None]] = None,
     ) -> None:
-        async with create_task_group() as tg, receive_stream:
+        """
+        Processes events concurrently. Only as many events as the limiter has
+        tokens are dispatched at once, so the rest wait in the stream, and the
+        receivers wait as well once the stream is full. The events received are
+        processed even if the consumption is cancelled
+        """
+        dispatches = Semaphore(self._get_capacity(message_processing_limit))
+        async with receive_stream:
             with CancelScope(shield=True):
-                async for message in receive_stream:
-                    tg.start_soon(
-                        self.wrap,
-                        after_consume,
-                        self._dispatch_message,
-                        message_processing_limit,
-                        message,
-                    )
+                async with create_task_group() as tg:
+                    async for item in receive_stream:
+                        await dispatches.acquire()
+                        tg.start_soon(
+                            self._release_after,
+                            dispatches,
+                            self.wrap,
+                            after_consume,
+                            (
+                                self._dispatch_batch
+                                if self.batch_deduplication
+                                else self._dispatch_message
+                            ),
+                            message_processing_limit,
+                            item,
+                        )
+
+    async def _release_after(
+        self, semaphore: Semaphore, f: Callable, *args: Any
+    ) -> None:
+        try:
+            await f(*args)
+        finally:
+            semaphore.release()
 
     async def start_ordered_message_consumer(
         self,
@@ -347,78 +994,314 @@ class AsyncMessageDispatcher:
         Processes events waiting for the full processing of one event before proceeding to the next
         """
         async with receive_stream:
-            async for message in receive_stream:
-                try:
-                    await self._dispatch_message(message_processing_limit, message)
-                finally:
-                    if after_consume:
-                        after_consume()
+            async for item in receive_stream:
+                await self.wrap(
+                    after_consume,
+                    self._dispatch_in_order,
+                    message_processing_limit,
+                    item,
+                )
+
+    async def start_grouped_message_consumer(
+        self,
+        receive_stream: MemoryObjectReceiveStream,
+        message_processing_limit: CapacityLimiter,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Processes the events of the same message group (e.g. the `MessageGroupId`
+        of a FIFO queue) one after the other, while the events of different groups
+        are processed concurrently. Events without a group are processed concurrently.
+        """
+        lanes: Dict[str, Deque[Any]] = {}
+        async with create_task_group() as tg, receive_stream:
+            with CancelScope(shield=True):
+                async for item in receive_stream:
+                    for group, group_item in self._split_by_group(item):
+                        if group is None:
+                            tg.start_soon(
+                                self.wrap,
+                                after_consume,
+                                (
+                                    self._dispatch_batch
+                                    if self.batch_deduplication
+                                    else self._dispatch_message
+                                ),
+                                message_processing_limit,
+                                group_item,
+                            )
+                        elif group in lanes:
+                            lanes[group].append(group_item)
+                        else:
+                            lanes[group] = deque([group_item])
+                            tg.start_soon(
+                                self._consume_lane,
+                                lanes,
+                                group,
+                                message_processing_limit,
+                                after_consume,
+                            )
+
+    def _split_by_group(self, item: Any) -> List[Tuple[Optional[str], Any]]:
+        if not self.batch_deduplication:
+            return [(self._backend.get_message_group(item), item)]
+
+        # The batch is split into one batch per group, so stop watching it as a whole
+        if not self._unbuffer(item):
+            return []
+        return list(group_by(self._backend.get_message_group, item).items())
+
+    async def _consume_lane(
+        self,
+        lanes: Dict[str, Deque[Any]],
+        group: str,
+        limiter: CapacityLimiter,
+        after_consume: Optional[Callable[[], None]] = None,
+    ) -> None:
+        lane = lanes[group]
+        try:
+            while lane:
+                await self.wrap(
+                    after_consume, self._dispatch_in_order, limiter, lane.popleft()
+                )
+        finally:
+            del lanes[group]
+
+    async def _dispatch_in_order(self, limiter: CapacityLimiter, item: Any) -> None:
+        if self.batch_deduplication:
+            await self._dispatch_batch(limiter, item, preserve_order=True)
+        else:
+            await self._dispatch_message(limiter, item)
 
     def _get_consumers(self, message_data: Any) -> List[Union[Consumer, AsyncConsumer]]:
-        return [
-            consumer for consumer in self._consumers if consumer.accepts(message_data)
-        ]
+        return list(_route(self._routes, self._consumers, message_data))
 
     async def _dispatch_message(
         self, limiter: CapacityLimiter, message: Message
     ) -> None:
         async with limiter:
-            manifest = message.get_message_manifest()
+            if not self._unbuffer(message):
+                return
 
-            # If the message cannot be deserialized, just ignore it.
-            # ACK it anyway to avoid hanging on the same message over an over again
-            try:
-                if message.serializer_id is not None:
-                    message_data = (
-                        self.serializer_registry.deserialize_with_serializerid(
-                            message.content, message.serializer_id, manifest=manifest
-                        )
-                    )
-                else:
-                    # TODO: If no serializerid is supplied, at least we need to grab some
-                    # clue in the message to know which serializer must be used.
-                    # for now, rely on the default.
-                    message_data = self.serializer_registry.deserialize_with_class(
-                        message.content, object, manifest=manifest
-                    )
-            except SerializationError as e:
-                logger.error(e)
-                if not self.early_ack:
-                    # If not early ack, it means that the message has not been
-                    # acked yet
-                    await self._backend.acknowledge(message)
+            with self._track([message]):
+                # If the message cannot be deserialized, just ignore it.
+                # ACK it anyway to avoid hanging on the same message over an over again
+                try:
+                    message_data = await self._deserialize(message)
+                except SerializationError as e:
+                    logger.error(e)
+                    if not self.early_ack:
+                        # If not early ack, it means that the message has not been
+                        # acked yet
+                        await self._acknowledge(message)
+                    return
+
+                consumers = self._get_consumers(message_data)
+
+                if await self._deliver(message, message_data, consumers, self.cache):
+                    await self._acknowledge(message)
+
+    async def _dispatch_batch(
+        self,
+        limiter: CapacityLimiter,
+        messages: List[Message],
+        preserve_order: bool = False,
+    ) -> None:
+        """
+        Dispatches a batch of messages checking all the deduplication keys of
+        the batch at once, and storing them back at once before acknowledging
+        """
+        # The batch is watched in the buffer until it gets its share of capacity
+        async with limiter:
+            if not self._unbuffer(messages):
                 return
 
-            consumers = self._get_consumers(message_data)
+        with self._track(messages):
+            deliveries = []
+            for message in messages:
+                try:
+                    message_data = await self._deserialize(message)
+                except SerializationError as e:
+                    logger.error(e)
+                    if not self.early_ack:
+                        await self._acknowledge(message)
+                    continue
+
+                deliveries.append(
+                    (message, message_data, self._get_consumers(message_data))
+                )
+
+            cache = AsyncDeduplicationBatch(self.cache)
+            # Claims go straight to the cache, so there is nothing to load for them
+            if not self.claim_ttl:
+                await cache.load(
+                    [
+                        _get_message_key(consumer, message)
+                        for message, _, consumers in deliveries
+                        for consumer in consumers
+                    ]
+                )
+
+            messages_to_ack: List[Message] = []
+
+            async def _deliver(
+                message: Message,
+                message_data: Any,
+                consumers: List[Union[Consumer, AsyncConsumer]],
+            ) -> None:
+                async with limiter:
+                    if await self._deliver(message, message_data, consumers, cache):
+                        messages_to_ack.append(message)
+
+            if preserve_order:
+                for delivery in deliveries:
+                    await _deliver(*delivery)
+            else:
+                async with create_task_group() as tg:
+                    for delivery in deliveries:
+                        tg.start_soon(_deliver, *delivery)
+
+            await cache.flush()
+            for message in messages_to_ack:
+                await self._acknowledge(message)
+
+    async def _deserialize(self, message: Message) -> Any:
+        if (
+            self.offload_deserialization is not None
+            and isinstance(message.content, (str, bytes))
+            and len(message.content) > self.offload_deserialization
+        ):
+            return await to_thread.run_sync(
+                _deserialize,
+                self.serializer_registry,
+                message,
+                limiter=self._get_thread_limiter(),
+            )
+        return _deserialize(self.serializer_registry, message)
+
+    def _get_thread_limiter(self) -> CapacityLimiter:
+        # Created once the loop is running, since limiters cannot be created before
+        if self.thread_limiter is None:
+            self.thread_limiter = CapacityLimiter(40)
+        return self.thread_limiter
+
+    def _track(self, messages: List[Message]) -> ContextManager[None]:
+        return self._heartbeat.track(messages) if self._heartbeat else nullcontext()
+
+    async def _acknowledge(self, message: Message) -> None:
+        if self._ack_buffer:
+            await self._ack_buffer.add(message)
+        else:
+            await self._backend.acknowledge(message)
+
+    async def _deliver(
+        self,
+        message: Message,
+        message_data: Any,
+        consumers: List[Union[Consumer, AsyncConsumer]],
+        cache: AsyncDeduplicationCache,
+    ) -> bool:
+        """
+        Passes the message to the consumers, skipping those that already processed it.
 
+        Returns:
+            Whether the message must be acknowledged
+        """
+        if self.fan_out and len(consumers) > 1:
+            results: List[bool] = []
+
+            async def _deliver_to(consumer: Union[Consumer, AsyncConsumer]) -> None:
+                results.append(
+                    await self._deliver_to(consumer, message, message_data, cache)
+                )
+
+            async with create_task_group() as tg:
+                for consumer in consumers:
+                    tg.start_soon(_deliver_to, consumer)
+            successful = sum(results)
+        else:
             successful = 0
             for consumer in consumers:
-                try:
-                    # Store into the cache
-                    message_key = (
-                        f"{get_fully_qualified_name(consumer)}.{message.message_id}"
-                    )
+                successful += await self._deliver_to(
+                    consumer, message, message_data, cache
+                )
 
-                    if await self.cache.contains(message_key):
-                        logger.info("detected a duplicated message, ignoring")
-                    else:
-                        if isinstance(
-                            consumer, AsyncConsumer
-                        ) and asyncio.iscoroutinefunction(consumer.process):
-                            await consumer.process(
-                                message_data, message_id=message.message_id
-                            )
-                        else:
-                            consumer.process(
-                                message_data, message_id=message.message_id
-                            )
-                        successful += 1
-                        await self.cache.store(message_key, message_key)
-                except Exception as e:
-                    logger.exception(e)
+        return not self.early_ack and (self.always_ack or successful == len(consumers))
+
+    async def _deliver_to(
+        self,
+        consumer: Union[Consumer, AsyncConsumer],
+        message: Message,
+        message_data: Any,
+        cache: AsyncDeduplicationCache,
+    ) -> bool:
+        """
+        Returns whether the consumer processed the message, now or in the past
+        """
+        try:
+            # Store into the cache
+            message_key = _get_message_key(consumer, message)
+
+            if self.claim_ttl:
+                return await self._deliver_claimed(
+                    consumer,
+                    message,
+                    message_data,
+                    cast(AsyncClaimingDeduplicationCache, cache),
+                    message_key,
+                )
 
-            if not self.early_ack and (self.always_ack or successful == len(consumers)):
-                await self._backend.acknowledge(message)
+            if await cache.contains(message_key):
+                logger.info("detected a duplicated message, ignoring")
+            else:
+                await self._process(consumer, message_data, message.message_id)
+                await cache.store(message_key, message_key, self.deduplication_window)
+            return True
+        except Exception as e:
+            logger.exception(e)
+            return False
+
+    async def _deliver_claimed(
+        self,
+        consumer: Union[Consumer, AsyncConsumer],
+        message: Message,
+        message_data: Any,
+        cache: AsyncClaimingDeduplicationCache,
+        message_key: str,
+    ) -> bool:
+        assert self.claim_ttl
+        claim = await cache.claim(message_key, self.claim_ttl)
+        if claim == ClaimResult.PROCESSED:
+            logger.info("detected a duplicated message, ignoring")
+            return True
+        if claim == ClaimResult.IN_PROGRESS:
+            logger.info("the message is being processed somewhere else, skipping")
+            return False
+
+        try:
+            await self._process(consumer, message_data, message.message_id)
+        except Exception:
+            await cache.release(message_key)
+            raise
+        await cache.confirm(message_key, message_key, self.deduplication_window)
+        return True
+
+    async def _process(
+        self,
+        consumer: Union[Consumer, AsyncConsumer],
+        message_data: Any,
+        message_id: Optional[str],
+    ) -> None:
+        if isinstance(consumer, AsyncConsumer) and asyncio.iscoroutinefunction(
+            consumer.process
+        ):
+            await consumer.process(message_data, message_id=message_id)
+        else:
+            # Run the blocking consumers in a worker thread to keep the loop going
+            await to_thread.run_sync(
+                partial(consumer.process, message_data, message_id=message_id),
+                limiter=self._get_thread_limiter(),
+            )
 
 
 class SimpleMessageDispatcher(MessageDispatcher):
@@ -436,8 +1319,32 @@ class SimpleMessageDispatcher(MessageDispatcher):
         backend: Optional[MessagingBackend] = None,
         always_ack: bool = False,
         early_ack: bool = False,
+        max_workers: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        batch_deduplication: bool = False,
+        buffer_acks: bool = False,
+        ack_linger: float = 0.2,
+        prefetch: int = 0,
+        visibility_heartbeat: bool = False,
+        claim_ttl: Optional[int] = None,
+        deduplication_window: Optional[int] = None,
     ):
-        super().__init__(serializer_registry, cache, backend, always_ack, early_ack)
+        super().__init__(
+            serializer_registry,
+            cache,
+            backend,
+            always_ack,
+            early_ack,
+            max_workers,
+            max_processes,
+            batch_deduplication,
+            buffer_acks,
+            ack_linger,
+            prefetch,
+            visibility_heartbeat,
+            claim_ttl=claim_ttl,
+            deduplication_window=deduplication_window,
+        )
         self.attach_consumer(consumer)
 
 
@@ -456,6 +1363,36 @@ class AsyncSimpleMessageDispatcher(AsyncMessageDispatcher):
         cache: Optional[AsyncDeduplicationCache] = None,
         always_ack: bool = False,
         early_ack: bool = False,
+        batch_deduplication: bool = False,
+        visibility_heartbeat: bool = False,
+        buffer_acks: bool = False,
+        ack_linger: float = 0.2,
+        pollers: int = 1,
+        buffer_size: Optional[int] = None,
+        extend_buffered: bool = False,
+        release_buffered: bool = False,
+        thread_limiter: Optional[CapacityLimiter] = None,
+        claim_ttl: Optional[int] = None,
+        deduplication_window: Optional[int] = None,
+        offload_deserialization: Optional[int] = None,
     ):
-        super().__init__(serializer_registry, backend, cache, always_ack, early_ack)
+        super().__init__(
+            serializer_registry,
+            backend,
+            cache,
+            always_ack,
+            early_ack,
+            batch_deduplication,
+            visibility_heartbeat,
+            buffer_acks,
+            ack_linger,
+            pollers,
+            buffer_size,
+            extend_buffered,
+            release_buffered,
+            thread_limiter,
+            claim_ttl=claim_ttl,
+            deduplication_window=deduplication_window,
+            offload_deserialization=offload_deserialization,
+        )
         self.attach_consumer(consumer)
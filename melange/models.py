@@ -70,3 +70,24 @@ class MessageDto:
         self.message = message
         self.message_group_id = message_group_id
         self.message_deduplication_id = message_deduplication_id
+
+
+class PublishResult:
+    """
+    The outcome of publishing one of the messages of a batch: the id that the
+    queue assigned to the message, or the error that prevented its publishing
+    """
+
+    def __init__(
+        self,
+        message_dto: MessageDto,
+        message_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self.message_dto = message_dto
+        self.message_id = message_id
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
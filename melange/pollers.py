@@ -0,0 +1,45 @@
+from typing import Optional
+
+from anyio import Event
+
+
+class PollerScaler:
+    """
+    Decides how many of the concurrent pollers of a queue should be receiving
+    messages. A receive that comes back full (`batch_size` messages) means that
+    there are more messages waiting in the queue, so one more poller is activated,
+    up to `max_pollers`. A receive that comes back empty deactivates a poller,
+    down to `min_pollers`.
+
+    Pollers are identified by their index: the ones with an index lower than
+    the number of active pollers are the active ones.
+    """
+
+    def __init__(self, max_pollers: int, batch_size: int, min_pollers: int = 1):
+        self.max_pollers = max_pollers
+        self.min_pollers = min_pollers
+        self.batch_size = batch_size
+        self.active = min_pollers
+        self._activated: Optional[Event] = None
+
+    def is_active(self, index: int) -> bool:
+        return index < self.active
+
+    async def wait_until_active(self, index: int) -> None:
+        while not self.is_active(index):
+            if not self._activated:
+                self._activated = Event()
+            await self._activated.wait()
+
+    def record(self, received: int) -> None:
+        """
+        Scales the active pollers according to the number of messages of a receive
+        """
+        if received >= self.batch_size and self.active < self.max_pollers:
+            self.active += 1
+            # anyio events cannot be cleared, so drop it after waking the waiters
+            if self._activated:
+                self._activated.set()
+                self._activated = None
+        elif received == 0 and self.active > self.min_pollers:
+            self.active -= 1
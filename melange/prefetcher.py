@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Generic, Iterable, Iterator, Optional, Tuple
+
+from melange.helpers.typing import T
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class MessagePrefetcher(Generic[T]):
+    """
+    Pulls the messages (or batches of messages) of an iterable on a background
+    thread and keeps up to `max_size` of them in a buffer, so that receiving
+    the next messages overlaps with the processing of the current ones.
+
+    If `max_age` is supplied (usually the visibility timeout of the queue), the
+    receiver stops pulling messages while the buffered ones would not be dispatched
+    before `max_age` seconds, based on the pace at which they are being consumed.
+    Items that still spend more than `max_age` seconds in the buffer are dropped,
+    since the backend will have made them visible again to other consumers.
+    """
+
+    def __init__(
+        self, items: Iterable[T], max_size: int, max_age: Optional[float] = None
+    ) -> None:
+        self._items = items
+        self.max_size = max_size
+        self.max_age = max_age
+        self._buffer: "queue.Queue[Tuple[float, Any]]" = queue.Queue(maxsize=max_size)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Average time between two items being taken from the buffer
+        self._interval = 0.0
+        self._last_taken: Optional[float] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._receive, name="melange-prefetcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def __iter__(self) -> Iterator[T]:
+        if not self._thread:
+            self.start()
+
+        try:
+            while True:
+                received_at, item = self._buffer.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+
+                self._track_pace()
+                if self.max_age and time.monotonic() - received_at > self.max_age:
+                    logger.warning(
+                        "A prefetched message outlived its visibility timeout "
+                        "before being dispatched, skipping"
+                    )
+                    continue
+
+                yield item
+        finally:
+            self.stop()
+
+    def _track_pace(self) -> None:
+        now = time.monotonic()
+        if self._last_taken is not None:
+            self._interval = 0.8 * self._interval + 0.2 * (now - self._last_taken)
+        self._last_taken = now
+
+    def _projected_wait(self) -> float:
+        return (self._buffer.qsize() + 1) * self._interval
+
+    def _receive(self) -> None:
+        try:
+            iterator = iter(self._items)
+            while not self._stopped.is_set():
+                while (
+                    self.max_age
+                    and self._projected_wait() > self.max_age
+                    and not self._stopped.is_set()
+                ):
+                    time.sleep(0.05)
+
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+
+                self._put((time.monotonic(), item))
+        except Exception as e:
+            self._put((time.monotonic(), e))
+            return
+
+        self._put((time.monotonic(), _END))
+
+    def _put(self, entry: Tuple[float, Any]) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._buffer.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
@@ -56,6 +56,16 @@ class SerializerRegistry:
         for k, v in self._serializers_by_id.items():
             self._quickserializer_by_identity[k] = v
 
+        # Serializers are stateless, so one instance per serializer is shared
+        # by every message
+        self._instances: Dict[Type[Serializer], Serializer] = {
+            v: v() for v in self._config_serializers.values()
+        }
+
+        # Memoizes the resolution of a type to its serializer, including the
+        # subclass lookups and the fallback to the default serializer
+        self._resolved_types: Dict[Type, Type[Serializer]] = {}
+
     def get_serializer_by_id(self, id: int) -> Type[Serializer]:
         if id < 1024:
             serializer = self._quickserializer_by_identity[id]
@@ -68,16 +78,27 @@ class SerializerRegistry:
     def get_serializer_by_name(self, name: str) -> Type[Serializer]:
         return self._config_serializers[name]
 
+    def get_serializer_instance(self, serializer: Type[Serializer]) -> Serializer:
+        """
+        Returns the shared instance of a serializer class
+        """
+        instance = self._instances.get(serializer)
+        if instance is None:
+            instance = self._instances[serializer] = serializer()
+        return instance
+
     def deserialize_with_serializerid(
         self, data: str, serializer_id: int, manifest: Optional[str]
     ) -> Any:
-        serializer = self.get_serializer_by_id(serializer_id)()
+        serializer = self.get_serializer_instance(
+            self.get_serializer_by_id(serializer_id)
+        )
         return serializer.deserialize(data, manifest)
 
     def deserialize_with_class(
         self, data: str, klass: Type, manifest: Optional[str]
     ) -> Any:
-        serializer = self.serializer_for(klass)()
+        serializer = self.get_serializer_instance(self.serializer_for(klass))
         return serializer.deserialize(data, manifest)
 
     def serialize(self, obj: Any) -> str:
@@ -86,9 +107,15 @@ class SerializerRegistry:
         return data
 
     def find_serializer_for(self, obj: Any) -> Serializer:
-        return self.serializer_for(type(obj))()
+        return self.get_serializer_instance(self.serializer_for(type(obj)))
 
     def serializer_for(self, type: Type) -> Type[Serializer]:
+        serializer = self._resolved_types.get(type)
+        if serializer is None:
+            serializer = self._resolved_types[type] = self._resolve_serializer(type)
+        return serializer
+
+    def _resolve_serializer(self, type: Type) -> Type[Serializer]:
         if self._serializer_map.get(type):
             return self._serializer_map[type]
         else:
@@ -0,0 +1,90 @@
+import time
+from typing import cast
+
+import anyio
+from doublex import Spy, called, never
+from hamcrest import *
+
+from melange.backends.acknowledgement import (
+    AcknowledgementBuffer,
+    AsyncAcknowledgementBuffer,
+)
+from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
+from melange.models import Message
+
+
+class TestAcknowledgementBuffer:
+    def test_flush_the_acknowledgements_once_the_buffer_is_full(self):
+        backend = Spy(MessagingBackend)
+        sut = AcknowledgementBuffer(
+            cast(MessagingBackend, backend), max_size=3, linger=60
+        )
+        messages = [Message.create("apple", None, 40) for _ in range(3)]
+
+        for message in messages[:2]:
+            sut.add(message)
+
+        assert_that(backend.acknowledge_batch, never(called()))
+
+        sut.add(messages[2])
+
+        assert_that(backend.acknowledge_batch, called().with_args(messages))
+
+    def test_flush_the_acknowledgements_after_the_linger_time(self):
+        backend = Spy(MessagingBackend)
+        sut = AcknowledgementBuffer(cast(MessagingBackend, backend), linger=0.01)
+        message = Message.create("apple", None, 40)
+
+        sut.add(message)
+        time.sleep(0.2)
+
+        assert_that(backend.acknowledge_batch, called().with_args([message]))
+
+
+class RecordingAsyncBackend(AsyncMessagingBackend):
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.batches = []
+
+    async def acknowledge_batch(self, messages):
+        await anyio.sleep(self.delay)
+        self.batches.append(messages)
+
+
+class TestAsyncAcknowledgementBuffer:
+    async def test_flush_the_acknowledgements_after_the_linger_time(
+        self, anyio_backend
+    ):
+        backend = RecordingAsyncBackend()
+        message = Message.create("apple", None, 40)
+
+        async with AsyncAcknowledgementBuffer(backend, linger=0.01) as sut:
+            await sut.add(message)
+            await anyio.sleep(0.2)
+
+            assert_that(backend.batches, equal_to([[message]]))
+
+    async def test_flush_the_pending_acknowledgements_on_exit(self, anyio_backend):
+        backend = RecordingAsyncBackend()
+        messages = [Message.create("apple", None, 40) for _ in range(3)]
+
+        async with AsyncAcknowledgementBuffer(backend, linger=60) as sut:
+            for message in messages:
+                await sut.add(message)
+
+            assert_that(backend.batches, empty())
+
+        assert_that(backend.batches, equal_to([messages]))
+
+    async def test_complete_the_flush_in_progress_on_exit(self, anyio_backend):
+        backend = RecordingAsyncBackend(delay=0.1)
+        messages = [Message.create("apple", None, 40) for _ in range(3)]
+
+        async with AsyncAcknowledgementBuffer(backend, linger=0.01) as sut:
+            for message in messages:
+                await sut.add(message)
+
+            await anyio.sleep(0.05)
+
+        assert_that(backend.batches, equal_to([messages]))
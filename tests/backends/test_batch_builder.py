@@ -0,0 +1,75 @@
+from typing import Dict
+
+from hamcrest import *
+
+from melange.backends.sqs.batch_builder import BatchBuilder
+
+
+def _entry(id: str, size: int) -> Dict:
+    return {"Id": id, "MessageBody": "x" * size}
+
+
+def _ids(batches):
+    return [[entry["Id"] for entry in batch] for batch in batches]
+
+
+def test_measure_the_body_and_the_attributes_of_an_entry():
+    entry = {
+        "Id": "1",
+        "MessageBody": "añb",
+        "MessageAttributes": {
+            "manifest": {"DataType": "String", "StringValue": "apple"},
+            "serializer_id": {"DataType": "Number", "StringValue": "40"},
+        },
+    }
+
+    size = BatchBuilder().size(entry)
+
+    assert_that(size, equal_to(4 + (8 + 6 + 5) + (13 + 6 + 2)))
+
+
+def test_split_the_entries_in_batches_of_up_to_10():
+    entries = [_entry(str(i), 10) for i in range(25)]
+
+    batches = BatchBuilder().build(entries)
+
+    assert_that([len(batch) for batch in batches], contains_exactly(10, 10, 5))
+
+
+def test_pack_the_entries_in_the_fewest_batches_within_the_size_limit():
+    sizes = {"a": 60, "b": 50, "c": 40, "d": 30, "e": 20}
+    entries = [_entry(id, size) for id, size in sizes.items()]
+
+    batches = BatchBuilder(max_bytes=100).build(entries)
+
+    assert_that(
+        _ids(batches),
+        contains_inanyorder(
+            contains_inanyorder("a", "c"),
+            contains_inanyorder("b", "d", "e"),
+        ),
+    )
+
+
+def test_keep_the_order_of_the_entries_if_required():
+    sizes = {"a": 60, "b": 50, "c": 40, "d": 30, "e": 20}
+    entries = [_entry(id, size) for id, size in sizes.items()]
+
+    batches = BatchBuilder(max_bytes=100).build(entries, ordered=True)
+
+    assert_that(_ids(batches), contains_exactly(["a"], ["b", "c"], ["d", "e"]))
+
+
+def test_reject_the_entries_too_large_to_be_sent():
+    sut = BatchBuilder(max_bytes=100)
+    entries = [_entry("a", 10), _entry("big", 150), _entry("b", 10)]
+
+    sendable, failed = sut.reject_oversized(entries)
+
+    assert_that([entry["Id"] for entry in sendable], contains_exactly("a", "b"))
+    assert_that(
+        failed,
+        contains_exactly(
+            has_entries(Id="big", Code="MessageTooLong", SenderFault=True)
+        ),
+    )
@@ -0,0 +1,204 @@
+import threading
+import time
+from typing import List, cast
+
+import anyio
+from doublex import ANY_ARG, Spy, called, never
+from hamcrest import *
+
+from melange.backends.batching import AsyncBatchingPublisher, BatchingPublisher
+from melange.backends.interfaces import AsyncMessagingBackend, MessagingBackend
+from melange.models import MessageDto, PublishResult, QueueWrapper
+from tests.fixtures import create_message_dtos
+
+
+def _publish_results(
+    message_dtos: List[MessageDto], queue: QueueWrapper
+) -> List[PublishResult]:
+    return [
+        PublishResult(message_dto, f"id-{message_dto.message.content}")
+        for message_dto in message_dtos
+    ]
+
+
+class SlowBackend(MessagingBackend):
+    def __init__(self, delay: float = 0.1) -> None:
+        super().__init__()
+        self.delay = delay
+        self.batches: List[List[MessageDto]] = []
+        self.concurrency = 0
+        self.max_concurrency = 0
+        self._lock = threading.Lock()
+
+    def publish_to_queue_batch(
+        self, message_dtos: List[MessageDto], queue: QueueWrapper
+    ) -> List[PublishResult]:
+        with self._lock:
+            self.concurrency += 1
+            self.max_concurrency = max(self.max_concurrency, self.concurrency)
+        time.sleep(self.delay)
+        with self._lock:
+            self.concurrency -= 1
+            self.batches.append(message_dtos)
+        return _publish_results(message_dtos, queue)
+
+
+class TestBatchingPublisher:
+    def _backend(self) -> Spy:
+        with Spy(MessagingBackend) as backend:
+            backend.publish_to_queue_batch(ANY_ARG).delegates(_publish_results)
+        return backend
+
+    def test_publish_the_messages_once_the_batch_is_full(self):
+        backend = self._backend()
+        sut = BatchingPublisher(cast(MessagingBackend, backend), max_size=3, linger=60)
+        queue = QueueWrapper("my-queue")
+        message_dtos = create_message_dtos(3)
+
+        futures = [sut.publish(message_dto, queue) for message_dto in message_dtos[:2]]
+
+        assert_that(backend.publish_to_queue_batch, never(called()))
+
+        futures.append(sut.publish(message_dtos[2], queue))
+
+        assert_that(
+            backend.publish_to_queue_batch, called().with_args(message_dtos, queue)
+        )
+        assert_that(
+            [future.result(timeout=1).message_id for future in futures],
+            contains_exactly("id-message-0", "id-message-1", "id-message-2"),
+        )
+
+    def test_publish_the_messages_after_the_linger_time(self):
+        backend = self._backend()
+        sut = BatchingPublisher(cast(MessagingBackend, backend), linger=0.01)
+        message_dto = create_message_dtos(1)[0]
+
+        future = sut.publish(message_dto, QueueWrapper("my-queue"))
+
+        assert_that(future.result(timeout=1).message_dto, is_(message_dto))
+
+    def test_flush_publishes_the_messages_of_every_queue(self):
+        backend = self._backend()
+        sut = BatchingPublisher(cast(MessagingBackend, backend), linger=60)
+        message_dtos = create_message_dtos(2)
+
+        futures = [
+            sut.publish(message_dtos[0], QueueWrapper("a-queue")),
+            sut.publish(message_dtos[1], QueueWrapper("another-queue")),
+        ]
+        sut.flush()
+
+        assert_that(backend.publish_to_queue_batch, called().times(2))
+        assert_that([future.done() for future in futures], only_contains(True))
+
+    def test_send_the_batches_of_a_queue_one_at_a_time_and_in_order(self):
+        backend = SlowBackend()
+        sut = BatchingPublisher(
+            cast(MessagingBackend, backend), max_size=2, linger=0.01
+        )
+        queue = QueueWrapper("my-queue")
+        message_dtos = create_message_dtos(3)
+
+        futures = [sut.publish(message_dtos[0], queue)]
+        # The linger flush of the first message is in progress
+        time.sleep(0.05)
+        futures += [sut.publish(message_dto, queue) for message_dto in message_dtos[1:]]
+
+        for future in futures:
+            future.result(timeout=1)
+
+        assert_that(backend.batches, equal_to([message_dtos[:1], message_dtos[1:]]))
+        assert_that(backend.max_concurrency, equal_to(1))
+
+    def test_fail_the_futures_when_the_batch_cannot_be_published(self):
+        with Spy(MessagingBackend) as backend:
+            backend.publish_to_queue_batch(ANY_ARG).raises(ConnectionError())
+        sut = BatchingPublisher(cast(MessagingBackend, backend), max_size=1)
+
+        future = sut.publish(create_message_dtos(1)[0], QueueWrapper("my-queue"))
+
+        assert_that(future.exception(timeout=1), instance_of(ConnectionError))
+
+
+class RecordingAsyncBackend(AsyncMessagingBackend):
+    def __init__(self, delay: float = 0.0) -> None:
+        super().__init__()
+        self.delay = delay
+        self.batches: List[List[MessageDto]] = []
+        self.concurrency = 0
+        self.max_concurrency = 0
+
+    async def publish_to_queue_batch(
+        self, message_dtos: List[MessageDto], queue: QueueWrapper
+    ) -> List[PublishResult]:
+        self.concurrency += 1
+        self.max_concurrency = max(self.max_concurrency, self.concurrency)
+        await anyio.sleep(self.delay)
+        self.concurrency -= 1
+        self.batches.append(message_dtos)
+        return _publish_results(message_dtos, queue)
+
+
+class TestAsyncBatchingPublisher:
+    async def test_publish_the_messages_after_the_linger_time(self, anyio_backend):
+        backend = RecordingAsyncBackend()
+        results: List[PublishResult] = []
+
+        queue = QueueWrapper("my-queue")
+
+        async with AsyncBatchingPublisher(backend, linger=0.01) as sut:
+            for message_dto in create_message_dtos(2):
+                await sut.publish(message_dto, queue, results.append)
+
+            await anyio.sleep(0.2)
+
+            assert_that(backend.batches, has_length(1))
+            assert_that(
+                [result.message_id for result in results],
+                contains_exactly("id-message-0", "id-message-1"),
+            )
+
+    async def test_flush_the_pending_messages_on_exit(self, anyio_backend):
+        backend = RecordingAsyncBackend()
+        results: List[PublishResult] = []
+
+        async with AsyncBatchingPublisher(backend, linger=60) as sut:
+            await sut.publish(
+                create_message_dtos(1)[0], QueueWrapper("my-queue"), results.append
+            )
+
+            assert_that(results, empty())
+
+        assert_that(results, has_length(1))
+
+    async def test_complete_the_flush_in_progress_on_exit(self, anyio_backend):
+        backend = RecordingAsyncBackend(delay=0.1)
+        results: List[PublishResult] = []
+        queue = QueueWrapper("my-queue")
+
+        async with AsyncBatchingPublisher(backend, linger=0.01) as sut:
+            for message_dto in create_message_dtos(3):
+                await sut.publish(message_dto, queue, results.append)
+
+            await anyio.sleep(0.05)
+
+        assert_that(backend.batches, has_length(1))
+        assert_that(results, has_length(3))
+
+    async def test_send_the_batches_of_a_queue_one_at_a_time_and_in_order(
+        self, anyio_backend
+    ):
+        backend = RecordingAsyncBackend(delay=0.1)
+        queue = QueueWrapper("my-queue")
+        message_dtos = create_message_dtos(3)
+
+        async with AsyncBatchingPublisher(backend, max_size=2, linger=0.01) as sut:
+            await sut.publish(message_dtos[0], queue)
+            # The linger flush of the first message is in progress
+            await anyio.sleep(0.05)
+            for message_dto in message_dtos[1:]:
+                await sut.publish(message_dto, queue)
+
+        assert_that(backend.batches, equal_to([message_dtos[:1], message_dtos[1:]]))
+        assert_that(backend.max_concurrency, equal_to(1))
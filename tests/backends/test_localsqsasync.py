@@ -5,11 +5,15 @@ import uuid
 
 import funcy
 import pytest
+from aiobotocore.config import AioConfig
 from anyio import from_thread
 from hamcrest import *
 
 from melange.backends.interfaces import AsyncMessagingBackend
-from melange.backends.sqs.sqs_backend_async import AsyncLocalSQSBackend
+from melange.backends.sqs.sqs_backend_async import (
+    AsyncBaseSQSBackend,
+    AsyncLocalSQSBackend,
+)
 from melange.models import Message, MessageDto
 
 
@@ -294,6 +298,47 @@ async def test_send_messages_through_a_non_fifo_queue_does_not_guarantee_order(
     assert_that(received_messages, contains_inanyorder(*expected_array))
 
 
+async def test_reuse_the_clients_of_a_started_backend(
+    backend: AsyncLocalSQSBackend, request, anyio_backend
+):
+    def delete_queue():
+        with from_thread.start_blocking_portal(backend="asyncio") as portal:
+            portal.start_task_soon(backend.delete_queue, queue)
+
+    request.addfinalizer(delete_queue)
+
+    async with backend:
+        queue_name = "test-queue-{}".format(uuid.uuid4())
+        queue, _ = await backend.declare_queue(queue_name)
+        sqs = backend._clients["sqs"]
+
+        await backend.publish_to_queue(Message.create("my-message", None, 40), queue)
+        messages = [m async for m in backend.retrieve_messages(queue)]
+        await backend.acknowledge_batch(messages)
+
+        assert_that(backend._clients["sqs"], is_(sqs))
+        assert_that([m.content for m in messages], contains_exactly("my-message"))
+
+    assert_that(backend._clients, empty())
+
+
+async def test_keep_the_pool_size_of_the_configuration_of_the_clients(anyio_backend):
+    backend = AsyncBaseSQSBackend(
+        extra_settings=dict(
+            region_name="us-east-1",
+            aws_secret_access_key="x",
+            aws_access_key_id="x",
+            config=AioConfig(max_pool_connections=50, connect_timeout=5),
+        )
+    )
+
+    async with backend:
+        config = backend._clients["sqs"].meta.config
+
+        assert_that(config.max_pool_connections, is_(50))
+        assert_that(config.connect_timeout, is_(5))
+
+
 async def test_backend_declare_a_queue_for_a_topic_filtering_the_events_it_sends_to_certain_queues(
     backend: AsyncMessagingBackend, topic, anyio_backend
 ):
@@ -363,3 +408,21 @@ async def _assert_messages(
     received_event_types = [message.manifest for message in messages]
     for type in expected_types_contained:
         assert type in received_event_types
+
+
+async def test_cache_the_queues_until_they_are_deleted(
+    backend: AsyncLocalSQSBackend, anyio_backend
+):
+    queue_name = "test-queue-{}".format(uuid.uuid4())
+    await backend.declare_queue(queue_name)
+    queue = await backend.get_queue(queue_name)
+
+    try:
+        assert_that(await backend.get_queue(queue_name), is_(queue))
+        assert_that(
+            await backend.get_queue_url(queue_name), equal_to(queue.unwrapped_obj.url)
+        )
+    finally:
+        await backend.delete_queue(queue)
+
+    assert_that(backend._queues.get(queue_name), none())
@@ -0,0 +1,293 @@
+import json
+import logging
+from types import SimpleNamespace
+from typing import Dict, List
+
+from hamcrest import *
+
+from melange.backends.sqs.localsqs import LocalSQSBackend
+from melange.backends.sqs.sqs_backend_async import AsyncLocalSQSBackend
+from melange.models import Message, MessageDto, QueueWrapper
+from tests.fixtures import create_message_dtos
+
+QUEUE_URL = "http://localhost:4566/000000000000/my-queue"
+
+
+class FakeQueue:
+    url = QUEUE_URL
+
+
+class FakeSQSClient:
+    """
+    Fails the entries of the given contents (or receipt handles) the first `failures` times they are sent
+    """
+
+    def __init__(self, failing: Dict[str, Dict], failures: int = 1) -> None:
+        self.failing = failing
+        self.failures = failures
+        self.calls: List[List[Dict]] = []
+        self.queue_urls: List[str] = []
+        self._attempts: Dict[str, int] = {}
+
+    async def send_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        return self._respond(QueueUrl, Entries, "MessageBody")
+
+    async def delete_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        return self._respond(QueueUrl, Entries, "ReceiptHandle")
+
+    def _respond(self, queue_url: str, entries: List[Dict], key: str) -> Dict:
+        self.calls.append(entries)
+        self.queue_urls.append(queue_url)
+        response: Dict = {"Successful": [], "Failed": []}
+        for entry in entries:
+            content = entry[key]
+            if key == "MessageBody":
+                content = json.loads(content)["Message"]
+
+            self._attempts[content] = self._attempts.get(content, 0) + 1
+            if content in self.failing and self._attempts[content] <= self.failures:
+                response["Failed"].append({"Id": entry["Id"], **self.failing[content]})
+            else:
+                response["Successful"].append(
+                    {"Id": entry["Id"], "MessageId": f"id-{content}"}
+                )
+        return response
+
+
+def _backend(client: FakeSQSClient, **kwargs) -> AsyncLocalSQSBackend:
+    backend = AsyncLocalSQSBackend(batch_backoff=0.001, **kwargs)
+    backend._clients["sqs"] = client
+    backend._queue_attributes.put(
+        QUEUE_URL, {"FifoQueue": "true" if kwargs.get("fifo") else "false"}
+    )
+    return backend
+
+
+async def test_publish_every_chunk_of_the_batch(anyio_backend):
+    client = FakeSQSClient(failing={})
+    backend = _backend(client)
+    message_dtos = create_message_dtos(25)
+
+    results = await backend.publish_to_queue_batch(
+        message_dtos, QueueWrapper(FakeQueue())
+    )
+
+    assert_that(sorted(len(call) for call in client.calls), contains_exactly(5, 10, 10))
+    assert_that(
+        [result.message_dto for result in results], contains_exactly(*message_dtos)
+    )
+    assert_that(results, only_contains(has_property("succeeded", True)))
+
+
+async def test_retry_only_the_failed_entries(anyio_backend):
+    client = FakeSQSClient(
+        failing={"message-3": {"Code": "InternalError", "SenderFault": False}}
+    )
+    backend = _backend(client)
+
+    results = await backend.publish_to_queue_batch(
+        create_message_dtos(5), QueueWrapper(FakeQueue())
+    )
+
+    assert_that(client.calls, has_length(2))
+    assert_that(
+        client.calls[1],
+        contains_exactly(has_entry("MessageBody", contains_string("message-3"))),
+    )
+    assert_that(results, only_contains(has_property("succeeded", True)))
+
+
+async def test_report_the_entries_that_cannot_be_published(anyio_backend):
+    client = FakeSQSClient(
+        failing={
+            "message-1": {
+                "Code": "InvalidParameterValue",
+                "Message": "too big",
+                "SenderFault": True,
+            }
+        }
+    )
+    backend = _backend(client)
+
+    results = await backend.publish_to_queue_batch(
+        create_message_dtos(3), QueueWrapper(FakeQueue())
+    )
+
+    assert_that(client.calls, has_length(1))
+    assert_that(
+        [result.error for result in results],
+        contains_exactly(None, "InvalidParameterValue: too big", None),
+    )
+
+
+class RaisingSQSClient(FakeSQSClient):
+    """
+    Raises the first `failures` times the batch with the given content is sent
+    """
+
+    def __init__(self, raising: str, failures: int = 1) -> None:
+        super().__init__(failing={})
+        self.raising = raising
+        self.raising_failures = failures
+
+    async def send_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        contents = [json.loads(entry["MessageBody"])["Message"] for entry in Entries]
+        if self.raising in contents and self.raising_failures:
+            self.raising_failures -= 1
+            self.calls.append(Entries)
+            raise RuntimeError("Throttled")
+        return await super().send_message_batch(QueueUrl, Entries)
+
+
+async def test_retry_the_batches_whose_call_raised(anyio_backend):
+    client = RaisingSQSClient(raising="message-0")
+    backend = _backend(client)
+
+    results = await backend.publish_to_queue_batch(
+        create_message_dtos(25), QueueWrapper(FakeQueue())
+    )
+
+    assert_that(client.calls, has_length(4))
+    assert_that(results, has_length(25))
+    assert_that(results, only_contains(has_property("succeeded", True)))
+
+
+async def test_report_the_entries_of_the_batches_whose_call_kept_raising(
+    anyio_backend,
+):
+    client = RaisingSQSClient(raising="message-0", failures=10)
+    backend = _backend(client, batch_retries=2)
+
+    results = await backend.publish_to_queue_batch(
+        create_message_dtos(25), QueueWrapper(FakeQueue())
+    )
+
+    failed = [result for result in results if not result.succeeded]
+    assert_that(failed, has_length(10))
+    assert_that(failed, only_contains(has_property("error", "RuntimeError: Throttled")))
+    assert_that([result for result in results if result.succeeded], has_length(15))
+
+
+def _received_messages(queue_url: str, count: int) -> List[Message]:
+    return [
+        Message(
+            f"{queue_url}-{i}",
+            f"message-{i}",
+            {"QueueUrl": queue_url, "ReceiptHandle": f"{queue_url}-handle-{i}"},
+            40,
+        )
+        for i in range(count)
+    ]
+
+
+async def test_acknowledge_the_messages_of_every_queue(anyio_backend):
+    client = FakeSQSClient(failing={})
+    backend = _backend(client)
+    messages = _received_messages("queue-a", 12) + _received_messages("queue-b", 3)
+
+    await backend.acknowledge_batch(messages)
+
+    assert_that(client.queue_urls, contains_inanyorder("queue-a", "queue-a", "queue-b"))
+    assert_that(
+        [entry["ReceiptHandle"] for call in client.calls for entry in call],
+        contains_inanyorder(*[m.metadata["ReceiptHandle"] for m in messages]),
+    )
+
+
+async def test_retry_the_acknowledgements_that_failed(anyio_backend):
+    client = FakeSQSClient(
+        failing={"queue-a-handle-1": {"Code": "InternalError", "SenderFault": False}}
+    )
+    backend = _backend(client)
+
+    await backend.acknowledge_batch(_received_messages("queue-a", 3))
+
+    assert_that(client.calls, has_length(2))
+    assert_that(
+        client.calls[1],
+        contains_exactly(has_entry("ReceiptHandle", "queue-a-handle-1")),
+    )
+
+
+async def test_report_the_messages_too_large_to_be_sent(anyio_backend):
+    client = FakeSQSClient(failing={})
+    backend = _backend(client, max_batch_bytes=1000)
+    message_dtos = create_message_dtos(3) + [
+        MessageDto(Message.create("x" * 2000, None, 40))
+    ]
+
+    results = await backend.publish_to_queue_batch(
+        message_dtos, QueueWrapper(FakeQueue())
+    )
+
+    assert_that(client.calls, contains_exactly(has_length(3)))
+    assert_that(results[3].error, starts_with("MessageTooLong"))
+    assert_that(results[:3], only_contains(has_property("succeeded", True)))
+
+
+async def test_keep_the_order_of_the_messages_of_a_fifo_queue(anyio_backend):
+    client = FakeSQSClient(failing={})
+    backend = _backend(client, max_batch_bytes=1000, fifo=True)
+    message_dtos = [
+        MessageDto(Message.create(f"{i}-" + "x" * 300, None, 40), "group")
+        for i in range(6)
+    ]
+
+    await backend.publish_to_queue_batch(message_dtos, QueueWrapper(FakeQueue()))
+
+    assert_that(
+        [
+            json.loads(entry["MessageBody"])["Message"][0]
+            for call in client.calls
+            for entry in call
+        ],
+        contains_exactly("0", "1", "2", "3", "4", "5"),
+    )
+    assert_that(client.calls, contains_exactly(has_length(3), has_length(3)))
+
+
+class FakeSyncSQSClient:
+    def __init__(self, failing: List[str]) -> None:
+        self.failing = failing
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        return {
+            "Successful": [
+                {"Id": entry["Id"]}
+                for entry in Entries
+                if entry["ReceiptHandle"] not in self.failing
+            ],
+            "Failed": [
+                {"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid"}
+                for entry in Entries
+                if entry["ReceiptHandle"] in self.failing
+            ],
+        }
+
+
+def test_log_the_acknowledgements_that_failed_in_the_sync_backend(caplog):
+    client = FakeSyncSQSClient(failing=["handle-1"])
+    messages = [
+        Message(
+            f"id-{i}",
+            f"message-{i}",
+            SimpleNamespace(
+                queue_url=QUEUE_URL,
+                receipt_handle=f"handle-{i}",
+                meta=SimpleNamespace(client=client),
+            ),
+            40,
+        )
+        for i in range(3)
+    ]
+
+    with caplog.at_level(logging.WARNING):
+        LocalSQSBackend().acknowledge_batch(messages)
+
+    assert_that(
+        caplog.text,
+        all_of(
+            contains_string("Could not acknowledge 1 messages"),
+            contains_string("handle-1"),
+        ),
+    )
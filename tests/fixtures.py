@@ -1,8 +1,11 @@
 import json
-from typing import Any, Dict, Optional
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
 
 from melange import SingleDispatchConsumer, consumer
 from melange.consumers import AsyncConsumer, AsyncSingleDispatchConsumer, async_consumer
+from melange.infrastructure.cache import PROCESSING_MARKER, ClaimResult
+from melange.models import Message, MessageDto
 from melange.serializers import Serializer
 
 
@@ -45,6 +48,17 @@ class AsyncBananaConsumer(AsyncConsumer):
     pass
 
 
+class CountingBananaConsumer(BananaConsumer):
+    accepts_by_type = True
+
+    def __init__(self) -> None:
+        self.accepts_calls = 0
+
+    def accepts(self, message: Any) -> bool:
+        self.accepts_calls += 1
+        return super().accepts(message)
+
+
 class NoBananaConsumer(SingleDispatchConsumer):
     @consumer
     def on_banana_event(self, event: NotBananaHappened) -> None:
@@ -77,3 +91,91 @@ class SerializerStub(Serializer):
         if serialized_data != "apple":
             data = json.loads(serialized_data)
             return BananaHappened(somevalue=data["value"])
+
+
+class InMemoryCache:
+    """
+    A deduplication cache that keeps the keys in a dictionary
+    and counts the calls made to it
+    """
+
+    def __init__(self, values: Optional[Dict[str, Any]] = None) -> None:
+        self.values = values or {}
+        self.expires: Dict[str, Optional[int]] = {}
+        self.call_count: Dict[str, int] = defaultdict(lambda: 0)
+
+    def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.call_count["store"] += 1
+        self.values[key] = value
+        self.expires[key] = expire
+
+    def get(self, key: str) -> Any:
+        return self.values.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        self.call_count["contains"] += 1
+        return key in self.values
+
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        self.call_count["contains_many"] += 1
+        return [key in self.values for key in keys]
+
+    def store_many(self, items: Dict[str, Any], expire: Optional[int] = None) -> None:
+        self.call_count["store_many"] += 1
+        self.values.update(items)
+
+    def claim(self, key: str, ttl: int) -> ClaimResult:
+        self.call_count["claim"] += 1
+        if key not in self.values:
+            self.values[key] = PROCESSING_MARKER
+            return ClaimResult.CLAIMED
+        if self.values[key] == PROCESSING_MARKER:
+            return ClaimResult.IN_PROGRESS
+        return ClaimResult.PROCESSED
+
+    def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.call_count["confirm"] += 1
+        self.values[key] = value
+
+    def release(self, key: str) -> None:
+        self.call_count["release"] += 1
+        self.values.pop(key, None)
+
+
+class AsyncInMemoryCache:
+    def __init__(self, values: Optional[Dict[str, Any]] = None) -> None:
+        self.cache = InMemoryCache(values)
+
+    @property
+    def call_count(self) -> Dict[str, int]:
+        return self.cache.call_count
+
+    async def store(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.cache.store(key, value, expire)
+
+    async def get(self, key: str) -> Any:
+        return self.cache.get(key)
+
+    async def contains(self, key: str) -> bool:
+        return key in self.cache
+
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        return self.cache.contains_many(keys)
+
+    async def store_many(
+        self, items: Dict[str, Any], expire: Optional[int] = None
+    ) -> None:
+        self.cache.store_many(items, expire)
+
+    async def claim(self, key: str, ttl: int) -> ClaimResult:
+        return self.cache.claim(key, ttl)
+
+    async def confirm(self, key: str, value: Any, expire: Optional[int] = None) -> None:
+        self.cache.confirm(key, value, expire)
+
+    async def release(self, key: str) -> None:
+        self.cache.release(key)
+
+
+def create_message_dtos(count: int) -> List[MessageDto]:
+    return [MessageDto(Message.create(f"message-{i}", None, 40)) for i in range(count)]
@@ -1,6 +1,7 @@
 from hamcrest import *
 
 from melange.infrastructure.async_cache import AsyncRedisCache
+from melange.infrastructure.cache import ClaimResult
 
 
 class TestAsyncCache:
@@ -14,3 +15,30 @@ class TestAsyncCache:
         assert_that(value, is_("falafel"))
         assert_that(await cache.contains("potato"), is_(True))
         assert_that(await cache.contains("banana"), is_(False))
+
+    async def test_store_and_check_many_keys_at_once(self, anyio_backend):
+        cache = AsyncRedisCache(
+            host="redis", port=6379, db=0, password=None, expire=3600
+        )
+
+        await cache.store_many({"potato": "falafel", "tomato": "hummus"})
+        assert_that(await cache.get("tomato"), is_("hummus"))
+        assert_that(
+            await cache.contains_many(["potato", "banana", "tomato"]),
+            is_([True, False, True]),
+        )
+
+    async def test_claim_a_key_before_confirming_it(self, anyio_backend):
+        cache = AsyncRedisCache(
+            host="redis", port=6379, db=0, password=None, expire=3600
+        )
+        await cache.release("pear")
+
+        assert_that(await cache.claim("pear", 60), is_(ClaimResult.CLAIMED))
+        assert_that(await cache.claim("pear", 60), is_(ClaimResult.IN_PROGRESS))
+
+        await cache.confirm("pear", "confirmed")
+        assert_that(await cache.claim("pear", 60), is_(ClaimResult.PROCESSED))
+
+        await cache.release("pear")
+        assert_that(await cache.claim("pear", 60), is_(ClaimResult.CLAIMED))
@@ -0,0 +1,75 @@
+import pytest
+from hamcrest import *
+
+from melange.infrastructure.async_cache import AsyncBloomFilterCache
+from melange.infrastructure.bloom_cache import BloomFilter, BloomFilterCache
+
+
+class TestBloomFilter:
+    def test_size_the_filter_for_the_false_positive_rate(self):
+        sut = BloomFilter(capacity=1000, error_rate=0.01)
+
+        assert_that(sut.size, is_(9586))
+        assert_that(sut.hash_count, is_(7))
+        assert_that(set(sut.positions("potato")), has_length(7))
+
+    def test_a_key_is_present_if_all_its_bits_are_set_in_any_window(self):
+        sut = BloomFilter(capacity=1000, error_rate=0.25)
+
+        bits = [1, 0, 1, 1] + [0, 0, 0, 0] + [0, 1, 1, 1]
+        assert_that(sut.hash_count, is_(2))
+        assert_that(sut.presence(bits, windows=2), is_([True, False, True]))
+
+
+class TestBloomFilterCache:
+    def test_remember_the_stored_keys(self):
+        sut = BloomFilterCache(capacity=1000, error_rate=0.01)
+
+        sut.store_many({f"key-{i}": f"key-{i}" for i in range(1000)})
+
+        assert_that("key-7" in sut, is_(True))
+        assert_that(sut.contains_many(["key-1", "key-999"]), is_([True, True]))
+        false_positives = sum(sut.contains_many([f"other-{i}" for i in range(1000)]))
+        assert_that(false_positives, less_than(30))
+
+    def test_forget_the_keys_of_the_expired_windows(self):
+        sut = BloomFilterCache(window=60, windows=2)
+        now = sut.windows.current()
+
+        sut.windows.current = lambda: now
+        sut.store("potato", "potato")
+        sut.windows.current = lambda: now + 1
+        assert_that("potato" in sut, is_(True))
+
+        sut.windows.current = lambda: now + 2
+        sut.store("tomato", "tomato")
+        assert_that("potato" in sut, is_(False))
+        assert_that("tomato" in sut, is_(True))
+
+    def test_reject_an_expiration_longer_than_the_windows_keep_the_keys(self):
+        sut = BloomFilterCache(window=60, windows=3)
+
+        sut.store("potato", "potato", expire=120)
+
+        assert_that(
+            calling(sut.store).with_args("tomato", "tomato", expire=121),
+            raises(ValueError, "kept for 120 seconds"),
+        )
+
+
+class TestAsyncBloomFilterCache:
+    async def test_remember_the_stored_keys(self, anyio_backend):
+        sut = AsyncBloomFilterCache(capacity=1000, error_rate=0.01)
+
+        await sut.store("potato", "potato")
+
+        assert_that(await sut.contains("potato"), is_(True))
+        assert_that(await sut.contains_many(["tomato", "potato"]), is_([False, True]))
+
+    async def test_reject_an_expiration_longer_than_the_windows_keep_the_keys(
+        self, anyio_backend
+    ):
+        sut = AsyncBloomFilterCache(window=60, windows=3)
+
+        with pytest.raises(ValueError):
+            await sut.store_many({"potato": "potato"}, expire=121)
@@ -1,6 +1,7 @@
 from hamcrest import *
 
-from melange.infrastructure.cache import RedisCache
+from melange.infrastructure.bloom_cache import BloomFilterCache
+from melange.infrastructure.cache import ClaimResult, RedisCache
 
 
 class TestAsyncCache:
@@ -12,3 +13,48 @@ class TestAsyncCache:
         assert_that(value, is_("falafel"))
         assert_that(cache.contains("potato"), is_(True))
         assert_that(cache.contains("banana"), is_(False))
+
+    def test_store_and_check_many_keys_at_once(self):
+        cache = RedisCache(host="redis", port=6379, db=0, password=None, expire=3600)
+
+        cache.store_many({"potato": "falafel", "tomato": "hummus"})
+        assert_that(cache.get("tomato"), is_("hummus"))
+        assert_that(
+            cache.contains_many(["potato", "banana", "tomato"]),
+            is_([True, False, True]),
+        )
+
+    def test_claim_a_key_before_confirming_it(self):
+        cache = RedisCache(host="redis", port=6379, db=0, password=None, expire=3600)
+        cache.release("pear")
+
+        assert_that(cache.claim("pear", 60), is_(ClaimResult.CLAIMED))
+        assert_that(cache.claim("pear", 60), is_(ClaimResult.IN_PROGRESS))
+
+        cache.confirm("pear", "confirmed")
+        assert_that(cache.claim("pear", 60), is_(ClaimResult.PROCESSED))
+
+        cache.release("pear")
+        assert_that(cache.claim("pear", 60), is_(ClaimResult.CLAIMED))
+
+    def test_keep_a_bloom_filter_in_a_redis_bitmap(self):
+        cache = RedisCache(host="redis", port=6379, db=0, password=None, expire=3600)
+        sut = BloomFilterCache(
+            capacity=1000, client=cache.client, key_prefix="melange:test"
+        )
+
+        sut.store_many({"potato": "potato", "tomato": "tomato"})
+
+        assert_that(sut.contains_many(["potato", "banana"]), is_([True, False]))
+        assert_that("tomato" in sut, is_(True))
+
+    def test_keep_the_keys_for_the_expiration_of_the_cache(self):
+        cache = RedisCache(host="redis", port=6379, db=0, password=None, expire=600)
+
+        cache.store("potato", "falafel")
+        cache.store_many({"tomato": "hummus"}, expire=60)
+
+        assert_that(cache.client.ttl("potato"), is_(greater_than(590)))
+        assert_that(cache.client.ttl("tomato"), is_(less_than_or_equal_to(60)))
+        assert_that(cache.count_keys("*tomato"), is_(1))
+        assert_that(cache.count_keys(), is_(greater_than_or_equal_to(2)))
@@ -0,0 +1,72 @@
+import time
+
+from hamcrest import *
+
+from melange.infrastructure.async_cache import AsyncTieredDeduplicationCache
+from melange.infrastructure.cache import LocalCache, TieredDeduplicationCache
+from tests.fixtures import AsyncInMemoryCache, InMemoryCache
+
+
+class TestLocalCache:
+    def test_evict_the_least_recently_used_keys(self):
+        sut = LocalCache(max_size=2)
+
+        sut.put("potato", "falafel")
+        sut.put("tomato", "hummus")
+        assert_that("potato" in sut, is_(True))
+        sut.put("banana", "bread")
+
+        assert_that("tomato" in sut, is_(False))
+        assert_that(sut.get("potato"), is_("falafel"))
+        assert_that(sut.get("banana"), is_("bread"))
+
+    def test_forget_the_keys_after_their_ttl(self):
+        sut = LocalCache(ttl=0.05)
+
+        sut.put("potato", "falafel")
+        time.sleep(0.1)
+
+        assert_that("potato" in sut, is_(False))
+
+
+class TestTieredDeduplicationCache:
+    def test_answer_the_keys_written_by_this_process_locally(self):
+        cache = InMemoryCache()
+        sut = TieredDeduplicationCache(cache)
+
+        sut.store("potato", "falafel")
+
+        assert_that("potato" in sut, is_(True))
+        assert_that(sut.get("potato"), is_("falafel"))
+        assert_that(cache.call_count["store"], is_(1))
+        assert_that(cache.call_count["contains"], is_(0))
+
+    def test_check_the_missing_keys_against_the_underlying_cache(self):
+        cache = InMemoryCache({"tomato": "hummus"})
+        sut = TieredDeduplicationCache(cache)
+        sut.store("potato", "falafel")
+
+        assert_that(
+            sut.contains_many(["potato", "tomato", "banana"]),
+            is_([True, True, False]),
+        )
+        assert_that("tomato" in sut, is_(True))
+        assert_that("banana" in sut, is_(False))
+        assert_that(cache.call_count["contains_many"], is_(1))
+        # Only the negative answer is asked again
+        assert_that(cache.call_count["contains"], is_(1))
+
+
+class TestAsyncTieredDeduplicationCache:
+    async def test_answer_the_keys_written_by_this_process_locally(self, anyio_backend):
+        cache = AsyncInMemoryCache({"tomato": "hummus"})
+        sut = AsyncTieredDeduplicationCache(cache)
+
+        await sut.store("potato", "falafel")
+
+        assert_that(await sut.contains("potato"), is_(True))
+        assert_that(await sut.contains("tomato"), is_(True))
+        assert_that(await sut.contains("tomato"), is_(True))
+        assert_that(await sut.get("potato"), is_("falafel"))
+        assert_that(cache.call_count["store"], is_(1))
+        assert_that(cache.call_count["contains"], is_(1))
@@ -41,3 +41,39 @@ class TestSerializerRegistry:
 
         message_serializer = serializer_reg.find_serializer_for(BananaHappened(1))
         assert_that(message_serializer, is_(SerializerStub))
+
+    def test_serializers_are_instantiated_once(self):
+        serializer_reg = SerializerRegistry(
+            {
+                "serializers": {"json": JsonSerializer, "test": SerializerStub},
+                "serializer_bindings": {BaseMessage: "test"},
+                "default": "json",
+            }
+        )
+
+        first_serializer = serializer_reg.find_serializer_for(BananaHappened(1))
+        second_serializer = serializer_reg.find_serializer_for(BananaHappened(2))
+        assert_that(first_serializer, is_(same_instance(second_serializer)))
+        assert_that(
+            serializer_reg.get_serializer_instance(SerializerStub),
+            is_(same_instance(first_serializer)),
+        )
+
+    def test_the_serializer_of_a_type_is_resolved_once(self):
+        serializer_reg = SerializerRegistry(
+            {
+                "serializers": {"json": JsonSerializer, "test": SerializerStub},
+                "serializer_bindings": {BaseMessage: "test"},
+                "default": "json",
+            }
+        )
+
+        assert_that(
+            serializer_reg.serializer_for(BananaHappened), equal_to(SerializerStub)
+        )
+
+        serializer_reg._bindings.clear()
+        assert_that(
+            serializer_reg.serializer_for(BananaHappened), equal_to(SerializerStub)
+        )
+        assert_that(serializer_reg.serializer_for(int), equal_to(JsonSerializer))
@@ -1,15 +1,24 @@
+import threading
+import time
 from collections import defaultdict
 from typing import AsyncIterable, Dict, List
 
+import anyio
 from hamcrest import *
 
 from melange.backends.interfaces import AsyncMessagingBackend
-from melange.message_dispatcher import AsyncSimpleMessageDispatcher
+from melange.consumers import AsyncConsumer, Consumer
+from melange.infrastructure.cache import PROCESSING_MARKER
+from melange.message_dispatcher import (
+    AsyncMessageDispatcher,
+    AsyncSimpleMessageDispatcher,
+)
 from melange.models import Message
 from melange.serializers import JsonSerializer, PickleSerializer, SerializerRegistry
 from tests.fixtures import (
     AsyncBananaConsumer,
     AsyncExceptionaleConsumer,
+    AsyncInMemoryCache,
     AsyncNoBananaConsumer,
     BananaHappened,
     BaseMessage,
@@ -48,6 +57,17 @@ class StubAsyncMessagingBackend(AsyncMessagingBackend):
         self.call_count["acknowledge"] += 1
         return None
 
+    async def acknowledge_batch(self, messages: List[Message]) -> None:
+        self.call_count["acknowledge_batch"] += 1
+        self.call_count["acknowledged_in_batch"] += len(messages)
+        return None
+
+    async def change_visibility_batch(
+        self, messages: List[Message], visibility_timeout: int
+    ) -> None:
+        self.call_count["change_visibility_batch"] += 1
+        return None
+
 
 def a_backend_with_messages(messages: List[Message]) -> AsyncMessagingBackend:
     return StubAsyncMessagingBackend(messages)
@@ -139,3 +159,474 @@ class TestAsyncMessageDispatcher:
         )
         await sut.consume_event("queue")
         assert_that(backend.call_count["acknowledge"], is_(0))
+
+    async def test_deduplicate_a_whole_batch_at_once(self, anyio_backend):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        num_calls = 0
+
+        async def _(message):
+            nonlocal num_calls
+            num_calls += 1
+
+        consumer = AsyncBananaConsumer(_)
+        cache = AsyncInMemoryCache({"tests.fixtures.AsyncBananaConsumer.id-0": "1"})
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            batch_deduplication=True,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(num_calls, is_(2))
+        assert_that(backend.call_count["acknowledge"], is_(3))
+        assert_that(cache.call_count["contains_many"], is_(1))
+        assert_that(cache.call_count["store_many"], is_(1))
+        assert_that(cache.call_count["contains"], is_(0))
+
+    async def test_extend_the_visibility_of_the_messages_while_being_processed(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        backend.visibility_timeout = 1
+
+        async def _(message):
+            await anyio.sleep(0.8)
+
+        consumer = AsyncBananaConsumer(_)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            visibility_heartbeat=True,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(backend.call_count["change_visibility_batch"], is_(1))
+        assert_that(backend.call_count["acknowledge"], is_(1))
+
+    async def test_coalesce_the_acknowledgements_in_batches(self, anyio_backend):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(12)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        consumer = AsyncBananaConsumer()
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            buffer_acks=True,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(backend.call_count["acknowledge"], is_(0))
+        assert_that(backend.call_count["acknowledge_batch"], is_(2))
+        assert_that(backend.call_count["acknowledged_in_batch"], is_(12))
+
+    async def test_poll_concurrently_while_the_receives_come_back_full(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        backend = a_backend_with_messages(
+            [
+                Message.create(serialized_event, None, serializer.identifier())
+                for _ in range(10)
+            ]
+        )
+        concurrent_receives = []
+        in_flight = 0
+
+        async def retrieve_messages(queue, **kwargs):
+            nonlocal in_flight
+            in_flight += 1
+            concurrent_receives.append(in_flight)
+            await anyio.sleep(0.01)
+            in_flight -= 1
+            for message in backend.messages:
+                yield message
+
+        backend.retrieve_messages = retrieve_messages
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncBananaConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            pollers=4,
+        )
+        with anyio.move_on_after(0.3):
+            await sut.consume_loop("queue", anyio.CapacityLimiter(100))
+
+        assert_that(max(concurrent_receives), is_(4))
+
+    async def test_extend_the_visibility_of_the_messages_waiting_in_the_buffer(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+        backend.visibility_timeout = 1
+
+        async def _(message):
+            await anyio.sleep(0.8)
+
+        consumer = AsyncBananaConsumer(_)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            buffer_size=10,
+            extend_buffered=True,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(backend.call_count["change_visibility_batch"], is_(1))
+        assert_that(backend.call_count["acknowledge"], is_(2))
+
+    async def test_release_the_messages_that_waited_too_long_in_the_buffer(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+        backend.visibility_timeout = 1
+
+        async def _(message):
+            await anyio.sleep(1)
+
+        consumer = AsyncBananaConsumer(_)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            buffer_size=10,
+            release_buffered=True,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(backend.call_count["change_visibility_batch"], is_(1))
+        assert_that(backend.call_count["acknowledge"], is_(1))
+
+    async def test_stop_receiving_while_the_buffer_is_full(self, anyio_backend):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        backend = a_backend_with_messages([])
+        received = 0
+
+        async def retrieve_messages(queue, **kwargs):
+            nonlocal received
+            for _ in range(10):
+                received += 1
+                yield Message.create(serialized_event, None, serializer.identifier())
+
+        backend.retrieve_messages = retrieve_messages
+
+        async def _(message):
+            await anyio.sleep(0.1)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncBananaConsumer(_),
+            serializer_registry=registry,
+            backend=backend,
+            buffer_size=1,
+        )
+        with anyio.move_on_after(0.35):
+            await sut.consume_loop("queue", anyio.CapacityLimiter(1))
+
+        # 4 messages processed, 1 in the buffer and 1 waiting to get into it
+        assert_that(received, less_than_or_equal_to(7))
+
+    async def test_extend_the_visibility_of_the_batches_waiting_for_capacity(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        backend = a_backend_with_messages([])
+        backend.visibility_timeout = 1
+        batches = [2, 1]
+
+        async def retrieve_messages(queue, **kwargs):
+            await anyio.sleep(0.01)
+            for _ in range(batches.pop(0) if batches else 0):
+                yield Message.create(serialized_event, None, serializer.identifier())
+
+        backend.retrieve_messages = retrieve_messages
+
+        async def _(message):
+            await anyio.sleep(0.8)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncBananaConsumer(_),
+            serializer_registry=registry,
+            backend=backend,
+            batch_deduplication=True,
+            extend_buffered=True,
+        )
+        with anyio.move_on_after(2):
+            await sut.consume_loop("queue", anyio.CapacityLimiter(2))
+
+        # The second batch waits for the first one to release the capacity
+        assert_that(backend.call_count["change_visibility_batch"], is_(1))
+        assert_that(backend.call_count["acknowledge"], is_(3))
+
+    async def test_preserve_the_order_within_each_message_group(self, anyio_backend):
+        serializer = SerializerStub()
+
+        values = ["a1", "b1", "a2", "a3", "b2"]
+        messages = [
+            Message.create(
+                serializer.serialize(BananaHappened(value)),
+                None,
+                serializer.identifier(),
+                metadata=value[0],
+            )
+            for value in values
+        ]
+        backend = a_backend_with_messages(messages)
+        backend.get_message_group = lambda message: message.metadata
+
+        started = []
+        processed = []
+
+        async def _(event):
+            started.append(event.somevalue)
+            await anyio.sleep(0.05)
+            processed.append(event.somevalue)
+
+        consumer = AsyncBananaConsumer(_)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend
+        )
+        await sut.consume_event(
+            "queue", anyio.CapacityLimiter(10), preserve_group_order=True
+        )
+
+        assert_that([v for v in processed if v[0] == "a"], equal_to(["a1", "a2", "a3"]))
+        assert_that([v for v in processed if v[0] == "b"], equal_to(["b1", "b2"]))
+        # Both groups are processed concurrently
+        assert_that(started[:2], contains_inanyorder("a1", "b1"))
+        assert_that(processed[:2], contains_inanyorder("a1", "b1"))
+        assert_that(backend.call_count["acknowledge"], is_(5))
+
+    async def test_run_the_synchronous_consumers_in_worker_threads(self, anyio_backend):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+        threads = set()
+
+        def _(message):
+            threads.add(threading.get_ident())
+            time.sleep(0.2)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            Consumer(_),
+            serializer_registry=registry,
+            backend=backend,
+            thread_limiter=anyio.CapacityLimiter(2),
+        )
+        start = time.monotonic()
+        await sut.consume_event("queue", anyio.CapacityLimiter(2))
+
+        assert_that(time.monotonic() - start, less_than(0.35))
+        assert_that(threads, is_not(has_item(threading.get_ident())))
+        assert_that(backend.call_count["acknowledge"], is_(2))
+
+    async def test_run_the_synchronous_consumers_on_a_limiter_of_their_own(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        default_limiter = anyio.to_thread.current_default_thread_limiter()
+        borrowed_tokens = []
+
+        def _(message):
+            borrowed_tokens.append(default_limiter.borrowed_tokens)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            Consumer(_), serializer_registry=registry, backend=backend
+        )
+        await sut.consume_event("queue")
+
+        assert_that(borrowed_tokens, contains_exactly(0))
+        assert_that(sut.thread_limiter.total_tokens, is_(40))
+
+    async def test_pass_a_message_to_all_the_consumers_concurrently(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+
+        async def _(message):
+            await anyio.sleep(0.1)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncMessageDispatcher(registry, backend, fan_out=True)
+        for _i in range(3):
+            sut.attach_consumer(AsyncBananaConsumer(_))
+
+        start = time.monotonic()
+        await sut.consume_event("queue")
+
+        assert_that(time.monotonic() - start, less_than(0.25))
+        assert_that(backend.call_count["acknowledge"], is_(1))
+
+    async def test_claim_the_messages_before_processing_them(self, anyio_backend):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+        cache = AsyncInMemoryCache(
+            {"melange.consumers.AsyncConsumer.id-0": PROCESSING_MARKER}
+        )
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            claim_ttl=60,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(backend.call_count["acknowledge"], is_(1))
+        assert_that(cache.call_count["claim"], is_(2))
+        assert_that(cache.call_count["confirm"], is_(1))
+        assert_that(cache.call_count["contains"], is_(0))
+        assert_that(cache.call_count["store"], is_(0))
+
+    async def test_claim_the_messages_of_a_deduplicated_batch_in_the_cache(
+        self, anyio_backend
+    ):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+        cache = AsyncInMemoryCache(
+            {"melange.consumers.AsyncConsumer.id-0": PROCESSING_MARKER}
+        )
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            batch_deduplication=True,
+            claim_ttl=60,
+        )
+        await sut.consume_event("queue")
+
+        # id-0 is being processed somewhere else, so it must not be acknowledged
+        assert_that(backend.call_count["acknowledge"], is_(1))
+        assert_that(cache.call_count["claim"], is_(2))
+
+    async def test_deserialize_the_large_messages_in_a_worker_thread(
+        self, anyio_backend
+    ):
+        threads = {}
+
+        class ThreadRecordingSerializer(SerializerStub):
+            def deserialize(self, serialized_data, manifest=None):
+                data = super().deserialize(serialized_data, manifest)
+                threads[data.somevalue] = threading.get_ident()
+                return data
+
+        serializer = ThreadRecordingSerializer()
+        messages = [
+            Message.create(
+                serializer.serialize(BananaHappened(value)),
+                None,
+                serializer.identifier(),
+            )
+            for value in ["small", "large" * 20]
+        ]
+        backend = a_backend_with_messages(messages)
+
+        registry = SerializerRegistry(
+            {
+                **serializer_settings,
+                "serializers": {
+                    **serializer_settings["serializers"],
+                    "test": ThreadRecordingSerializer,
+                },
+            }
+        )
+        sut = AsyncSimpleMessageDispatcher(
+            AsyncBananaConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            offload_deserialization=50,
+        )
+        await sut.consume_event("queue")
+
+        assert_that(threads["small"], is_(threading.get_ident()))
+        assert_that(threads["large" * 20], is_not(threading.get_ident()))
+        assert_that(backend.call_count["acknowledge"], is_(2))
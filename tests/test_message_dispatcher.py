@@ -1,17 +1,23 @@
-from typing import Dict, List, cast
+import threading
+import time
+from typing import Any, Dict, List, cast
 
 from doublex import ANY_ARG, ProxySpy, Spy, called, never
 from hamcrest import *
 
-from melange import SimpleMessageDispatcher
+from melange import Consumer, MessageDispatcher, SimpleMessageDispatcher
 from melange.backends import MessagingBackend
+from melange.infrastructure.bloom_cache import BloomFilterCache
+from melange.infrastructure.cache import PROCESSING_MARKER
 from melange.models import Message
 from melange.serializers import JsonSerializer, PickleSerializer, SerializerRegistry
 from tests.fixtures import (
     BananaConsumer,
     BananaHappened,
     BaseMessage,
+    CountingBananaConsumer,
     ExceptionaleConsumer,
+    InMemoryCache,
     MessageStubInterface,
     NoBananaConsumer,
     SerializerStub,
@@ -25,6 +31,7 @@ def a_backend_with_messages(messages: List[Message]) -> MessagingBackend:
         backend.get_queue(ANY_ARG).returns({})
         backend.retrieve_messages(ANY_ARG).returns(messages)
         backend.yield_messages(ANY_ARG).returns(messages)
+        backend.yield_batches(ANY_ARG).returns([messages])
 
     return cast(MessagingBackend, backend)
 
@@ -105,3 +112,414 @@ class TestMessageDispatcher:
         )
         sut.consume_event("queue")
         assert_that(backend.acknowledge, never(called()))
+
+    def test_dispatch_messages_concurrently_on_a_thread_pool(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(4)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        # Every message waits for a second one to be in flight at the same time,
+        # which would never happen if the messages were dispatched sequentially
+        barrier = threading.Barrier(2, timeout=5)
+
+        def _(message: Any) -> None:
+            barrier.wait()
+
+        consumer = Consumer(_)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend, max_workers=2
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.acknowledge, called().times(4))
+
+    def test_dispatch_messages_on_a_process_pool(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            BananaConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            max_processes=2,
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.acknowledge, called().times(3))
+
+    def test_a_consumer_failing_on_the_process_pool_does_not_acknowledge(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            ExceptionaleConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            max_processes=2,
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.acknowledge, never(called()))
+
+    def test_deduplicate_a_whole_batch_at_once(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        processed = []
+        consumer = Consumer(processed.append)
+        cache = InMemoryCache({"melange.consumers.Consumer.id-0": "stored"})
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            batch_deduplication=True,
+        )
+        sut.consume_event("queue")
+
+        assert_that(processed, has_length(2))
+        assert_that(backend.acknowledge, called().times(3))
+        assert_that(cache.call_count["contains_many"], is_(1))
+        assert_that(cache.call_count["store_many"], is_(1))
+        assert_that(cache.call_count["contains"], is_(0))
+        assert_that(
+            cache.values,
+            all_of(
+                has_key("melange.consumers.Consumer.id-1"),
+                has_key("melange.consumers.Consumer.id-2"),
+            ),
+        )
+
+    def test_buffered_acknowledgements_are_sent_in_batches(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(12)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            BananaConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            buffer_acks=True,
+            ack_linger=60,
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.acknowledge, never(called()))
+        assert_that(backend.acknowledge_batch, called().with_args(messages[:10]))
+        assert_that(backend.acknowledge_batch, called().with_args(messages[10:]))
+
+    def test_accepts_is_asked_once_per_message_type(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        consumer = CountingBananaConsumer()
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend
+        )
+        sut.consume_event("queue")
+        assert_that(consumer.accepts_calls, is_(1))
+
+        sut.attach_consumer(NoBananaConsumer())
+        sut.consume_event("queue")
+        assert_that(consumer.accepts_calls, is_(2))
+        assert_that(backend.acknowledge, called().times(6))
+
+    def test_accepts_is_asked_for_every_message_if_the_consumer_opts_out(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        consumer = CountingBananaConsumer()
+        consumer.accepts_by_type = False
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend
+        )
+        sut.consume_event("queue")
+
+        assert_that(consumer.accepts_calls, is_(3))
+
+    def test_accepts_is_asked_for_every_message_if_the_consumer_overrides_it(self):
+        serializer = SerializerStub()
+
+        messages = [
+            Message.create(
+                serializer.serialize(BananaHappened(value)),
+                None,
+                serializer.identifier(),
+            )
+            for value in ["apple", "pear"]
+        ]
+        backend = a_backend_with_messages(messages)
+
+        class AppleConsumer(BananaConsumer):
+            def accepts(self, message: Any) -> bool:
+                return super().accepts(message) and message.somevalue == "apple"
+
+        consumer = ProxySpy(AppleConsumer())
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend
+        )
+        sut.consume_event("queue")
+
+        assert_that(consumer.process, called().times(1))
+
+    def test_consume_prefetching_the_messages(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(5)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        consumer = ProxySpy(BananaConsumer())
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer, serializer_registry=registry, backend=backend, prefetch=2
+        )
+        sut.consume_event("queue")
+
+        assert_that(consumer.process, called().times(5))
+        assert_that(backend.acknowledge, called().times(5))
+
+    def test_skip_the_prefetched_messages_that_the_heartbeat_could_not_extend(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message.create(serialized_event, None, serializer.identifier())
+            for _ in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+        backend.visibility_timeout = 1
+
+        consumer = ProxySpy(Consumer(lambda message: time.sleep(0.7)))
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            prefetch=2,
+            visibility_heartbeat=True,
+        )
+        sut.consume_event("queue")
+
+        # The second message waited for longer than half the visibility timeout
+        assert_that(consumer.process, called().times(1))
+
+    def test_extend_the_visibility_of_the_messages_while_being_processed(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        backend.visibility_timeout = 1
+
+        consumer = Consumer(lambda message: time.sleep(0.8))
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            visibility_heartbeat=True,
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.change_visibility_batch, called().with_args(messages, 1))
+        assert_that(backend.acknowledge, called().times(1))
+
+    def test_pass_a_message_to_all_the_consumers_concurrently(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message.create(serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        threads = set()
+
+        def _(message):
+            threads.add(threading.get_ident())
+            time.sleep(0.1)
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = MessageDispatcher(registry, backend=backend, fan_out=True)
+        for _i in range(3):
+            sut.attach_consumer(Consumer(_))
+
+        start = time.monotonic()
+        sut.consume_event("queue")
+
+        assert_that(time.monotonic() - start, less_than(0.25))
+        assert_that(threads, has_length(3))
+        assert_that(backend.acknowledge, called().times(1))
+
+    def test_claim_the_messages_before_processing_them(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(3)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        processed = []
+        consumer = Consumer(processed.append)
+        cache = InMemoryCache(
+            {
+                "melange.consumers.Consumer.id-0": "melange.consumers.Consumer.id-0",
+                "melange.consumers.Consumer.id-1": PROCESSING_MARKER,
+            }
+        )
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            claim_ttl=60,
+        )
+        sut.consume_event("queue")
+
+        # id-0 was already processed and id-1 is being processed somewhere else
+        assert_that(processed, has_length(1))
+        assert_that(backend.acknowledge, called().times(2))
+        assert_that(cache.call_count["claim"], is_(3))
+        assert_that(cache.call_count["confirm"], is_(1))
+        assert_that(cache.call_count["contains"], is_(0))
+        assert_that(cache.call_count["store"], is_(0))
+
+    def test_claim_the_messages_of_a_deduplicated_batch_in_the_cache(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [
+            Message(f"id-{i}", serialized_event, None, serializer.identifier())
+            for i in range(2)
+        ]
+        backend = a_backend_with_messages(messages)
+
+        processed = []
+        consumer = Consumer(processed.append)
+        cache = InMemoryCache({"melange.consumers.Consumer.id-0": PROCESSING_MARKER})
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            consumer,
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            batch_deduplication=True,
+            claim_ttl=60,
+        )
+        sut.consume_event("queue")
+
+        # id-0 is being processed somewhere else, so it must not be acknowledged
+        assert_that(processed, has_length(1))
+        assert_that(backend.acknowledge, called().times(1))
+        assert_that(cache.call_count["claim"], is_(2))
+
+    def test_claiming_requires_a_cache_that_can_claim_keys(self):
+        registry = SerializerRegistry(serializer_settings)
+
+        assert_that(
+            calling(MessageDispatcher).with_args(
+                registry, cache=BloomFilterCache(), backend=Spy(), claim_ttl=60
+            ),
+            raises(Exception, "BloomFilterCache"),
+        )
+
+    def test_release_the_claim_if_the_consumer_fails(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message("id-0", serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        cache = InMemoryCache()
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            ExceptionaleConsumer(),
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            claim_ttl=60,
+        )
+        sut.consume_event("queue")
+
+        assert_that(backend.acknowledge, never(called()))
+        assert_that(cache.call_count["release"], is_(1))
+        assert_that(cache.values, empty())
+
+    def test_store_the_deduplication_keys_for_the_deduplication_window(self):
+        serializer = SerializerStub()
+
+        serialized_event = serializer.serialize(BananaHappened("apple"))
+        messages = [Message("id-0", serialized_event, None, serializer.identifier())]
+        backend = a_backend_with_messages(messages)
+        cache = InMemoryCache()
+
+        registry = SerializerRegistry(serializer_settings)
+        sut = SimpleMessageDispatcher(
+            Consumer(),
+            serializer_registry=registry,
+            backend=backend,
+            cache=cache,
+            deduplication_window=600,
+        )
+        sut.consume_event("queue")
+
+        assert_that(cache.expires, is_({"melange.consumers.Consumer.id-0": 600}))
@@ -0,0 +1,45 @@
+import anyio
+from hamcrest import *
+
+from melange.pollers import PollerScaler
+
+
+class TestPollerScaler:
+    def test_activate_a_poller_when_a_receive_comes_back_full(self):
+        sut = PollerScaler(max_pollers=3, batch_size=10)
+
+        sut.record(10)
+        sut.record(10)
+        sut.record(10)
+
+        assert_that(sut.active, is_(3))
+        assert_that(sut.is_active(2), is_(True))
+        assert_that(sut.is_active(3), is_(False))
+
+    def test_deactivate_a_poller_when_a_receive_comes_back_empty(self):
+        sut = PollerScaler(max_pollers=3, batch_size=10)
+        sut.record(10)
+        sut.record(10)
+
+        sut.record(0)
+        sut.record(5)
+        sut.record(0)
+        sut.record(0)
+
+        assert_that(sut.active, is_(1))
+
+    async def test_wake_up_the_pollers_when_they_get_activated(self, anyio_backend):
+        sut = PollerScaler(max_pollers=2, batch_size=10)
+        woken = []
+
+        async def poller():
+            await sut.wait_until_active(1)
+            woken.append(1)
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(poller)
+            await anyio.sleep(0.01)
+            assert_that(woken, empty())
+            sut.record(10)
+
+        assert_that(woken, equal_to([1]))
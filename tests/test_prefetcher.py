@@ -0,0 +1,47 @@
+import time
+
+import pytest
+from hamcrest import *
+
+from melange.prefetcher import MessagePrefetcher
+
+
+class TestMessagePrefetcher:
+    def test_yield_all_the_items_in_order(self):
+        sut = MessagePrefetcher(range(10), max_size=3)
+
+        assert_that(list(sut), contains_exactly(*range(10)))
+
+    def test_do_not_receive_more_items_than_the_buffer_can_hold(self):
+        received = []
+
+        def items():
+            for i in range(10):
+                received.append(i)
+                yield i
+
+        sut = MessagePrefetcher(items(), max_size=2)
+        iterator = iter(sut)
+        assert_that(next(iterator), is_(0))
+        time.sleep(0.3)
+
+        # One item taken, two buffered, and one more waiting to be buffered
+        assert_that(len(received), less_than_or_equal_to(4))
+        sut.stop()
+
+    def test_skip_the_items_that_outlived_the_max_age(self):
+        sut = MessagePrefetcher(range(3), max_size=3, max_age=0.1)
+        sut.start()
+        time.sleep(0.3)
+
+        assert_that(list(sut), is_([]))
+
+    def test_propagate_the_errors_of_the_receiver(self):
+        def items():
+            yield 1
+            raise ValueError("Could not receive")
+
+        sut = MessagePrefetcher(items(), max_size=3)
+
+        with pytest.raises(ValueError):
+            list(sut)